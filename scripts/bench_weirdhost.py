@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 端到端基准测试：启动本地模拟站点，用合成账号跑完整的 weirdhost_renew 流程，
+# 输出 账号/分钟 与各阶段耗时。需要 Chrome，运行方式:
+#   xvfb-run --auto-servernum --server-args="-screen 0 1920x1080x24" python scripts/bench_weirdhost.py
+#   python scripts/bench_weirdhost.py --headless
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_weirdhost as mock
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def phase_latency(timing):
+    samples = {}
+    totals = {}
+    for r in timing.get("phases", []):
+        if r["count"]:
+            samples.setdefault(r["phase"], []).append(r["seconds"] / r["count"])
+            totals[r["phase"]] = totals.get(r["phase"], 0.0) + r["seconds"]
+    return {
+        phase: {
+            "samples": len(v),
+            "mean": round(sum(v) / len(v), 3),
+            "p50": round(percentile(v, 50), 3),
+            "p95": round(percentile(v, 95), 3),
+            "total": round(totals[phase], 3),
+        }
+        for phase, v in samples.items()
+    }
+
+
+def make_accounts(w, accounts):
+    out = []
+    for i, line in enumerate(mock.account_cookie_lines(accounts), 1):
+        cfg = w.parse_account_config(line)
+        out.append({
+            "index": i,
+            "cookie_env": f"MOCK_COOKIE_{i}",
+            "remark": cfg["remark"],
+            "cookie_str": cfg["cookie_str"],
+            "cookie_name": cfg["cookie_name"],
+            "cookie_value": cfg["cookie_value"],
+        })
+    return out
+
+
+def run_scenario(w, httpd, n_accounts, servers, workers, headless=False):
+    httpd.mock_state.accounts = mock.build_accounts(n_accounts, servers, seed=n_accounts)
+    httpd.mock_state.sessions.clear()
+    httpd.mock_state.stats = {"requests": 0, "renew_success": 0, "renew_cooldown": 0}
+    w.RUN_TIMER = w.RunTimer()
+    indexed = list(enumerate(make_accounts(w, httpd.mock_state.accounts)))
+
+    print(f"\n[BENCH] {n_accounts} 个账号 × {servers} 个服务器，{workers} 个进程")
+    start = time.time()
+    if workers > 1:
+        results, errors = w.run_accounts_in_pool(indexed, workers, headless=headless)
+    else:
+        results, error = w.run_accounts_in_browser(indexed, notify=False, headless=headless)
+        errors = [repr(error)] if error else []
+    wall = time.time() - start
+
+    statuses = {}
+    for r in results:
+        for s in r.get("servers", []):
+            statuses[s.get("status", "unknown")] = statuses.get(s.get("status", "unknown"), 0) + 1
+    return {
+        "accounts": n_accounts,
+        "servers_per_account": servers,
+        "workers": workers,
+        "wall_seconds": round(wall, 3),
+        "accounts_per_minute": round(len(results) / wall * 60, 2) if wall else 0,
+        "completed_accounts": len(results),
+        "server_statuses": statuses,
+        "errors": errors,
+        "mock_stats": dict(httpd.mock_state.stats),
+        "phases": phase_latency(w.RUN_TIMER.to_dict()),
+    }
+
+
+def print_scenario(report):
+    print(f"\n[BENCH] {report['accounts']} 账号: {report['wall_seconds']:.1f}s | "
+          f"{report['accounts_per_minute']:.2f} 账号/分钟 | 服务器结果 {report['server_statuses']}")
+    print(f"  {'阶段':<18}{'样本':>6}{'平均':>9}{'p50':>9}{'p95':>9}")
+    for phase, st in sorted(report["phases"].items(), key=lambda kv: -kv[1]["total"]):
+        print(f"  {phase:<18}{st['samples']:>6}{st['mean']:>8.2f}s{st['p50']:>8.2f}s{st['p95']:>8.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Weirdhost 续期流程基准测试（本地模拟站点）")
+    parser.add_argument("--accounts", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--servers", type=int, default=2, help="每个账号的服务器数")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--click-turnstile", action="store_true", help="伪 Turnstile 需要点击才通过")
+    parser.add_argument("--headless", action="store_true", help="无头模式（不需要 Xvfb，输入走 CDP）")
+    parser.add_argument("--latency-ms", type=int, default=0, help="模拟站点每个请求的额外延迟")
+    parser.add_argument("--output", default="bench_report.json")
+    args = parser.parse_args()
+
+    httpd, base = mock.start_mock_server(
+        {}, auto_solve=not args.click_turnstile, latency_ms=args.latency_ms,
+    )
+    workdir = tempfile.mkdtemp(prefix="weirdhost-bench-")
+    os.environ.update(mock.mock_env(base))
+    os.environ.update({
+        "WEIRDHOST_PACING": "0",
+        "WEIRDHOST_SESSION_DIR": os.path.join(workdir, "session"),
+        "WEIRDHOST_STATE_FILE": os.path.join(workdir, "state.json"),
+        "WEIRDHOST_TIMING_REPORT": os.path.join(workdir, "timing_report.json"),
+        "WEIRDHOST_JOURNAL_DIR": os.path.join(workdir, "journal"),
+        "WEIRDHOST_RUN_BUDGET_MIN": "0",
+    })
+    for name in ("TG_BOT_TOKEN", "TG_CHAT_ID", "REPO_TOKEN"):
+        os.environ.pop(name, None)
+    output = os.path.abspath(args.output)
+    os.chdir(workdir)
+    print(f"[BENCH] 模拟站点 {base}，工作目录 {workdir}")
+
+    import weirdhost_renew as w
+
+    reports = []
+    try:
+        for n in args.accounts:
+            report = run_scenario(w, httpd, n, args.servers, max(1, min(args.workers, n)), args.headless)
+            print_scenario(report)
+            reports.append(report)
+    finally:
+        w.shutdown_dispatcher()
+        httpd.shutdown()
+
+    with open(output, "w") as f:
+        json.dump({"base_url": base, "scenarios": reports}, f, ensure_ascii=False, indent=1)
+    print(f"\n[BENCH] 报告已写入 {output}")
+
+
+if __name__ == "__main__":
+    main()
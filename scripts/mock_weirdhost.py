@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 本地 Weirdhost 模拟站点：实现续期脚本用到的 API、服务器页面、伪 Turnstile 和结果弹窗，
+# 配合 WEIRDHOST_BASE_URL / WEIRDHOST_API_BASE_URL 让 weirdhost_renew.py 在本地完整运行。
+
+import argparse
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+COOKIE_NAME = "remember_web_mock"
+SESSION_COOKIE = "weirdhost_session"
+EXPIRY_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+# ============================================================
+#  模拟数据
+# ============================================================
+
+def build_accounts(count, servers_per_account=2, seed=0):
+    rng = random.Random(seed)
+    accounts = {}
+    for i in range(1, count + 1):
+        token = f"acct{i:04d}{secrets.token_hex(8)}"
+        servers = []
+        for j in range(1, servers_per_account + 1):
+            add_hours = rng.choice([24, 48, 72, 96])
+            # 一半服务器处于续期窗口内（会成功），另一半剩余时间较多（冷却）
+            remaining_h = rng.uniform(2, add_hours) if j % 2 else rng.uniform(add_hours + 12, add_hours * 3)
+            servers.append({
+                "uuid": f"{i:04d}{j:04d}-0000-4000-8000-{secrets.token_hex(6)}",
+                "identifier": f"{i:04d}{j:04d}",
+                "name": f"mock-{i}-{j}",
+                "server_type": "free" if j % 2 else "notfree",
+                "expire": datetime.now() + timedelta(hours=remaining_h),
+                "add_hours": add_hours,
+            })
+        accounts[token] = {"email": f"user{i}@example.com", "servers": servers}
+    return accounts
+
+
+def account_cookie_lines(accounts):
+    return [f"mock{i + 1}-----{COOKIE_NAME}={token}" for i, token in enumerate(accounts)]
+
+
+# ============================================================
+#  页面模板
+# ============================================================
+
+PAGE_HEAD = """<!doctype html><html lang="ko"><head><meta charset="utf-8"><title>Weirdhost Mock</title>
+<style>
+body { font-family: sans-serif; margin: 0; padding: 40px; }
+.modal { position: fixed; left: 35%; top: 25%; width: 420px; padding: 24px; background: #fff;
+         border: 1px solid #888; box-shadow: 0 4px 24px rgba(0,0,0,.3); }
+.cf-turnstile { width: 300px; height: 65px; overflow: hidden; }
+.cf-turnstile iframe { width: 300px; height: 65px; border: 0; }
+</style></head><body>"""
+
+TURNSTILE_WIDGET = """<!doctype html><html><body style="margin:0;cursor:pointer;background:#f9f9f9"
+ onclick="solve()"><label class="cb-lb" style="display:flex;align-items:center;height:65px">
+<input type="checkbox" style="margin:0 12px 0 20px;width:24px;height:24px">Verify you are human</label>
+<script>
+function solve() {
+  var token = 'mock.' + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2) + Date.now();
+  setTimeout(function() { parent.postMessage({whMockTurnstile: token}, '*'); }, SOLVE_DELAY_MS);
+}
+if (AUTO_SOLVE) solve();
+</script></body></html>"""
+
+TURNSTILE_BLOCK = """<div class="cf-turnstile"><input type="hidden" name="cf-turnstile-response" value="">
+<iframe src="/turnstile/widget?challenges.cloudflare.com" title="turnstile"></iframe></div>"""
+
+CHALLENGE_PAGE = PAGE_HEAD + """<h1>Just a moment...</h1>""" + TURNSTILE_BLOCK + """
+<script>
+window._cf_chl_opt = {cType: 'managed'};
+window.addEventListener('message', function(e) {
+  if (!e.data || !e.data.whMockTurnstile) return;
+  document.querySelector('input[name="cf-turnstile-response"]').value = e.data.whMockTurnstile;
+  document.cookie = 'cf_clearance=' + e.data.whMockTurnstile + '; path=/';
+});
+</script></body></html>"""
+
+LOGIN_PAGE = PAGE_HEAD + """<h1>Login</h1><form><input name="user"><input type="password"></form></body></html>"""
+
+# 和真实 SPA 一样，页面加载时自己请求服务器列表 / 服务器 info（供页面响应捕获复用）
+DASHBOARD_PAGE = PAGE_HEAD + """<div class="ServerControls"><h1>Servers</h1><ul>__LINKS__</ul></div>
+<script>fetch('/api/client?page=1', {headers: {'Accept': 'application/json'}});</script></body></html>"""
+
+SERVER_PAGE = PAGE_HEAD + """<h1>__NAME__</h1>
+<div class="ServerControls"><p id="expiry">유통기한 __EXPIRE__</p>
+<button id="renew" type="button"><span>연장하기</span></button></div>
+<div id="modal-root"></div>
+<script>
+var SERVER = __SERVER_JSON__;
+function xsrf() {
+  var m = document.cookie.match(/XSRF-TOKEN=([^;]+)/);
+  return m ? decodeURIComponent(m[1]) : '';
+}
+function showResult(ok, expire) {
+  var root = document.getElementById('modal-root');
+  root.innerHTML = ok
+    ? '<div class="modal"><h2>Success</h2><p>성공적으로 연장되었습니다</p><button type="button">NEXT</button></div>'
+    : '<div class="modal"><h2>Error</h2><p>아직 연장할 수 없습니다</p><button type="button">NEXT</button></div>';
+  root.querySelector('button').onclick = function() { root.innerHTML = ''; };
+  if (ok && expire) document.getElementById('expiry').textContent = '유통기한 ' + expire;
+}
+function submitRenewal(token) {
+  var kind = SERVER.server_type === 'free' ? 'freeservers' : 'notfreeservers';
+  fetch('/api/client/' + kind + '/' + SERVER.uuid + '/renew', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json', 'Accept': 'application/json',
+               'X-Requested-With': 'XMLHttpRequest', 'X-XSRF-TOKEN': xsrf()},
+    body: JSON.stringify({'cf-turnstile-response': token})
+  }).then(function(r) { return r.json(); }).then(function(d) {
+    showResult(!!d.success, d.data && d.data.expire);
+  });
+}
+(function() {
+  var kind = SERVER.server_type === 'free' ? 'freeservers' : 'notfreeservers';
+  fetch('/api/client/' + kind + '/' + SERVER.uuid + '/info', {headers: {'Accept': 'application/json'}});
+})();
+document.getElementById('renew').onclick = function() {
+  var root = document.getElementById('modal-root');
+  root.innerHTML = '<div class="modal"><p>시간추가</p>__TURNSTILE__'
+    + '<button type="button" style="margin-left:220px">시간추가</button></div>';
+};
+window.addEventListener('message', function(e) {
+  if (!e.data || !e.data.whMockTurnstile) return;
+  var input = document.querySelector('#modal-root input[name="cf-turnstile-response"]');
+  if (!input || input.value) return;
+  input.value = e.data.whMockTurnstile;
+  setTimeout(function() { submitRenewal(input.value); }, SUBMIT_DELAY_MS);
+});
+</script></body></html>"""
+
+
+def fill(template, values):
+    for key, value in values.items():
+        template = template.replace(key, value)
+    return template
+
+
+# ============================================================
+#  HTTP 处理
+# ============================================================
+
+class MockState:
+    def __init__(self, accounts, login_challenge=False, auto_solve=False,
+                 solve_delay_ms=600, submit_delay_ms=400, latency_ms=0, per_page=50):
+        self.accounts = accounts
+        self.login_challenge = login_challenge
+        self.auto_solve = auto_solve
+        self.solve_delay_ms = solve_delay_ms
+        self.submit_delay_ms = submit_delay_ms
+        self.latency_ms = latency_ms
+        self.per_page = per_page
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "renew_success": 0, "renew_cooldown": 0}
+
+    def find_server(self, account, key):
+        for s in account["servers"]:
+            if key in (s["uuid"], s["identifier"]):
+                return s
+        return None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "WeirdhostMock/1.0"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.mock_state
+
+    def cookies(self):
+        jar = SimpleCookie()
+        jar.load(self.headers.get("Cookie", ""))
+        return {k: m.value for k, m in jar.items()}
+
+    def current_account(self):
+        cookies = self.cookies()
+        token = self.state.sessions.get(cookies.get(SESSION_COOKIE))
+        if token is None:
+            token = cookies.get(COOKIE_NAME)
+        return token, self.state.accounts.get(token)
+
+    def send_body(self, status, body, content_type, set_cookies=()):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for c in set_cookies:
+            self.send_header("Set-Cookie", c)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload), "application/json")
+
+    def session_cookies(self, token):
+        cookies = self.cookies()
+        out = []
+        if self.state.sessions.get(cookies.get(SESSION_COOKIE)) != token:
+            sid = secrets.token_hex(16)
+            with self.state.lock:
+                self.state.sessions[sid] = token
+            out.append(f"{SESSION_COOKIE}={sid}; Path=/; HttpOnly")
+        if "XSRF-TOKEN" not in cookies:
+            out.append(f"XSRF-TOKEN={secrets.token_urlsafe(24)}; Path=/")
+        return out
+
+    def handle_any(self, method):
+        with self.state.lock:
+            self.state.stats["requests"] += 1
+        if self.state.latency_ms:
+            time.sleep(self.state.latency_ms / 1000)
+        url = urlparse(self.path)
+        path, query = url.path, parse_qs(url.query)
+
+        if path == "/turnstile/widget":
+            body = fill(TURNSTILE_WIDGET, {
+                "SOLVE_DELAY_MS": str(self.state.solve_delay_ms),
+                "AUTO_SOLVE": "true" if self.state.auto_solve else "false",
+            })
+            return self.send_body(200, body, "text/html; charset=utf-8")
+
+        if path.startswith("/api/client"):
+            return self.handle_api(method, path, query)
+
+        if self.state.login_challenge and "cf_clearance" not in self.cookies():
+            return self.send_body(403, CHALLENGE_PAGE, "text/html; charset=utf-8")
+
+        token, account = self.current_account()
+        if path.startswith("/auth/login"):
+            return self.send_body(200, LOGIN_PAGE, "text/html; charset=utf-8")
+        if account is None:
+            self.send_response(302)
+            self.send_header("Location", "/auth/login")
+            self.end_headers()
+            return
+
+        set_cookies = self.session_cookies(token)
+        m = re.match(r"^/server/([^/]+)/?$", path)
+        if m:
+            server = self.state.find_server(account, m.group(1))
+            if not server:
+                return self.send_body(404, PAGE_HEAD + "<h1>404</h1></body></html>", "text/html; charset=utf-8")
+            body = fill(SERVER_PAGE, {
+                "__NAME__": server["name"],
+                "__EXPIRE__": server["expire"].strftime(EXPIRY_FMT),
+                "__SERVER_JSON__": json.dumps({"uuid": server["uuid"], "server_type": server["server_type"]}),
+                "__TURNSTILE__": TURNSTILE_BLOCK.replace("\n", "").replace("'", "\\'"),
+                "SUBMIT_DELAY_MS": str(self.state.submit_delay_ms),
+            })
+            return self.send_body(200, body, "text/html; charset=utf-8", set_cookies)
+
+        links = "".join(f'<li><a href="/server/{s["identifier"]}">{s["name"]}</a></li>' for s in account["servers"])
+        return self.send_body(200, fill(DASHBOARD_PAGE, {"__LINKS__": links}), "text/html; charset=utf-8", set_cookies)
+
+    def handle_api(self, method, path, query):
+        token, account = self.current_account()
+        if account is None:
+            return self.send_json(401, {"errors": [{"code": "Unauthenticated"}]})
+
+        if path in ("/api/client", "/api/client/") and method == "GET":
+            per_page = int(query.get("per_page", [self.state.per_page])[0])
+            page = max(1, int(query.get("page", ["1"])[0]))
+            servers = account["servers"]
+            total_pages = max(1, (len(servers) + per_page - 1) // per_page)
+            chunk = servers[(page - 1) * per_page: page * per_page]
+            return self.send_json(200, {
+                "object": "list",
+                "data": [{"object": "server", "attributes": {
+                    "identifier": s["identifier"], "uuid": s["uuid"], "name": s["name"],
+                    "server_type": s["server_type"],
+                }} for s in chunk],
+                "meta": {"pagination": {
+                    "total": len(servers), "count": len(chunk), "per_page": per_page,
+                    "current_page": page, "total_pages": total_pages,
+                }},
+            })
+
+        if path == "/api/client/account/activity":
+            return self.send_json(200, {"object": "list", "data": [{"object": "activity_log", "attributes": {
+                "event": "auth:success", "timestamp": datetime.now().isoformat(),
+                "relationships": {"actor": {"object": "user", "attributes": {"email": account["email"]}}},
+            }}]})
+
+        m = re.match(r"^/api/client/(freeservers|notfreeservers)/([^/]+)/(info|renew)$", path)
+        if m:
+            server = self.state.find_server(account, m.group(2))
+            if not server:
+                return self.send_json(404, {"success": False, "message": "not found"})
+            if m.group(3) == "info" and method == "GET":
+                return self.send_json(200, {"success": True, "data": {
+                    "expire": server["expire"].strftime(EXPIRY_FMT), "addHours": server["add_hours"],
+                }})
+            if m.group(3) == "renew" and method == "POST":
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if len(body.get("cf-turnstile-response") or "") < 20:
+                    return self.send_json(400, {"success": False, "message": "turnstile"})
+                remaining_h = (server["expire"] - datetime.now()).total_seconds() / 3600
+                with self.state.lock:
+                    if remaining_h > server["add_hours"]:
+                        self.state.stats["renew_cooldown"] += 1
+                        return self.send_json(200, {"success": False, "message": "아직 연장할 수 없습니다"})
+                    server["expire"] += timedelta(hours=server["add_hours"])
+                    self.state.stats["renew_success"] += 1
+                return self.send_json(200, {"success": True, "data": {
+                    "expire": server["expire"].strftime(EXPIRY_FMT), "addHours": server["add_hours"],
+                }})
+
+        return self.send_json(404, {"errors": [{"code": "NotFound"}]})
+
+    def do_GET(self):
+        self.handle_any("GET")
+
+    def do_POST(self):
+        self.handle_any("POST")
+
+
+def start_mock_server(accounts, host="127.0.0.1", port=0, **options):
+    httpd = ThreadingHTTPServer((host, port), MockHandler)
+    httpd.daemon_threads = True
+    httpd.mock_state = MockState(accounts, **options)
+    thread = threading.Thread(target=httpd.serve_forever, name="weirdhost-mock", daemon=True)
+    thread.start()
+    base = f"http://{host}:{httpd.server_address[1]}"
+    return httpd, base
+
+
+def mock_env(base):
+    return {
+        "WEIRDHOST_BASE_URL": f"{base}/server/",
+        "WEIRDHOST_API_BASE_URL": f"{base}/api/client",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 Weirdhost 模拟站点")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--accounts", type=int, default=2)
+    parser.add_argument("--servers", type=int, default=2, help="每个账号的服务器数")
+    parser.add_argument("--login-challenge", action="store_true", help="首次访问返回伪 CF 挑战页")
+    parser.add_argument("--auto-solve", action="store_true", help="伪 Turnstile 无需点击自动通过")
+    parser.add_argument("--latency-ms", type=int, default=0)
+    args = parser.parse_args()
+
+    accounts = build_accounts(args.accounts, args.servers)
+    httpd, base = start_mock_server(
+        accounts, args.host, args.port, login_challenge=args.login_challenge,
+        auto_solve=args.auto_solve, latency_ms=args.latency_ms,
+    )
+    print(f"[INFO] 模拟站点已启动: {base}")
+    for k, v in mock_env(base).items():
+        print(f"export {k}={v}")
+    for i, line in enumerate(account_cookie_lines(accounts), 1):
+        print(f"export WEIRDHOST_COOKIE_{i}='{line}'")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,29 +5,42 @@ import os
 import sys
 import time
 import asyncio
-import aiohttp
 import base64
+import hashlib
+import importlib.util
+import io
 import random
 import re
 import subprocess
 import json
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
 from datetime import datetime, timedelta
-from urllib.parse import unquote
+from urllib.parse import unquote, urlparse
 
-from seleniumbase import SB
+# seleniumbase / aiohttp / pynacl / Pillow / python-xlib 都在用到时才导入，
+# status 等不需要浏览器的子命令可以快速启动
 
-try:
-    from nacl import encoding, public
-    NACL_AVAILABLE = True
-except ImportError:
-    NACL_AVAILABLE = False
+
+def module_available(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def nacl_available():
+    return module_available("nacl")
 
 sys.stdout.reconfigure(line_buffering=True)
 
-BASE_URL = "https://hub.weirdhost.xyz/server/"
-API_BASE_URL = "https://hub.weirdhost.xyz/api/client"
-DOMAIN = "hub.weirdhost.xyz"
-MAX_COOKIE_COUNT = 5
+BASE_URL = os.environ.get("WEIRDHOST_BASE_URL", "https://hub.weirdhost.xyz/server/")
+API_BASE_URL = os.environ.get("WEIRDHOST_API_BASE_URL", "https://hub.weirdhost.xyz/api/client")
+SITE_URL = "{0.scheme}://{0.netloc}".format(urlparse(BASE_URL))
+DOMAIN = urlparse(BASE_URL).hostname
+XVFB_SCREEN = "1920x1080x24"
 
 RENEWAL_BUTTON_SELECTORS = [
     "//button//span[contains(text(), '연장하기')]/parent::button",
@@ -43,6 +56,14 @@ RENEWAL_BUTTON_SELECTORS = [
 #  工具函数
 # ============================================================
 
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, "").strip() or default)
+    except ValueError:
+        print(f"[WARN] {name} 不是有效数字，使用 {default}")
+        return default
+
+
 def mask_sensitive(text, show_chars=3):
     if not text:
         return "***"
@@ -79,6 +100,10 @@ def mask_server_id(server_id):
     return server_id[:2] + "*" * (len(server_id) - 4) + server_id[-2:]
 
 
+def pacing_enabled():
+    return os.environ.get("WEIRDHOST_PACING", "1").strip() != "0"
+
+
 def random_delay(min_sec=0.5, max_sec=2.0):
     time.sleep(random.uniform(min_sec, max_sec))
 
@@ -152,6 +177,299 @@ def build_server_url(server_id):
     return server_id if server_id.startswith("http") else f"{BASE_URL}{server_id}"
 
 
+# ============================================================
+#  运行耗时统计（WebDriver 命令级计时）
+# ============================================================
+
+TIMING_REPORT_FILE = os.environ.get("WEIRDHOST_TIMING_REPORT", "timing_report.json")
+SB_TIMED_METHODS = ("uc_open_with_reconnect", "is_element_present", "click")
+DRIVER_TIMED_METHODS = ("execute_script", "execute_async_script", "get_screenshot_as_png")
+
+
+class RunTimer:
+    def __init__(self):
+        self.started = time.time()
+        self.account = "-"
+        self.server = "-"
+        self.phase = None
+        self._phase_start = None
+        self.phases = {}
+        self.commands = {}
+        self.page_loads = {}
+        self.api_sources = {}
+
+    def enter(self, phase, account=None, server=None):
+        now = time.perf_counter()
+        self._close(now)
+        if account is not None:
+            self.account = account
+            self.server = "-"
+        if server is not None:
+            self.server = server
+        self.phase = phase
+        self._phase_start = now
+
+    def stop(self):
+        self._close(time.perf_counter())
+        self.phase = None
+
+    def _close(self, now, count=True):
+        if self.phase is None:
+            return
+        rec = self.phases.setdefault((self.account, self.server, self.phase), [0, 0.0])
+        rec[0] += 1 if count else 0
+        rec[1] += now - self._phase_start
+
+    def record(self, command, elapsed):
+        key = (self.account, self.server, self.phase or "other", command)
+        rec = self.commands.setdefault(key, [0, 0.0, 0.0])
+        rec[0] += 1
+        rec[1] += elapsed
+        rec[2] = max(rec[2], elapsed)
+
+    def record_page_load(self, profile, metrics, open_seconds):
+        rec = self.page_loads.setdefault(profile, [0, 0.0, 0, 0, 0.0])
+        rec[0] += 1
+        rec[1] += metrics.get("load_ms", 0)
+        rec[2] += metrics.get("bytes", 0)
+        rec[3] += metrics.get("resources", 0)
+        rec[4] += open_seconds
+
+    def record_api(self, source, count=1):
+        self.api_sources[source] = self.api_sources.get(source, 0) + count
+
+    def _timed(self, command, func):
+        def wrapper(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(command, time.perf_counter() - t)
+        wrapper.__wh_timed__ = True
+        return wrapper
+
+    def instrument(self, sb):
+        targets = [(sb, "sb", SB_TIMED_METHODS), (sb.driver, "driver", DRIVER_TIMED_METHODS)]
+        for obj, prefix, names in targets:
+            for name in names:
+                func = getattr(obj, name, None)
+                if callable(func) and not getattr(func, "__wh_timed__", False):
+                    setattr(obj, name, self._timed(f"{prefix}.{name}", func))
+
+    def to_dict(self):
+        now = time.perf_counter()
+        self._close(now, count=False)
+        self._phase_start = now
+        return {
+            "started": self.started,
+            "phases": [
+                {"account": a, "server": s, "phase": p, "count": c, "seconds": round(t, 3)}
+                for (a, s, p), (c, t) in self.phases.items()
+            ],
+            "commands": [
+                {"account": a, "server": s, "phase": p, "command": cmd,
+                 "count": c, "seconds": round(t, 3), "max": round(m, 3)}
+                for (a, s, p, cmd), (c, t, m) in self.commands.items()
+            ],
+            "page_loads": [
+                {"profile": prof, "count": c, "load_ms": round(ms, 1), "bytes": b,
+                 "resources": r, "open_seconds": round(o, 3)}
+                for prof, (c, ms, b, r, o) in self.page_loads.items()
+            ],
+            "api_sources": dict(self.api_sources),
+        }
+
+    def merge(self, data):
+        for r in data.get("phases", []):
+            rec = self.phases.setdefault((r["account"], r["server"], r["phase"]), [0, 0.0])
+            rec[0] += r["count"]
+            rec[1] += r["seconds"]
+        for r in data.get("commands", []):
+            rec = self.commands.setdefault((r["account"], r["server"], r["phase"], r["command"]), [0, 0.0, 0.0])
+            rec[0] += r["count"]
+            rec[1] += r["seconds"]
+            rec[2] = max(rec[2], r["max"])
+        for r in data.get("page_loads", []):
+            rec = self.page_loads.setdefault(r["profile"], [0, 0.0, 0, 0, 0.0])
+            rec[0] += r["count"]
+            rec[1] += r["load_ms"]
+            rec[2] += r["bytes"]
+            rec[3] += r["resources"]
+            rec[4] += r["open_seconds"]
+        for source, c in data.get("api_sources", {}).items():
+            self.record_api(source, c)
+
+    def write_report(self, path=TIMING_REPORT_FILE):
+        self.stop()
+        report = self.to_dict()
+        report["wall_seconds"] = round(time.time() - self.started, 3)
+        try:
+            with open(path, "w") as f:
+                json.dump(report, f, ensure_ascii=False, indent=1)
+        except Exception as e:
+            print(f"[WARN] 耗时报告写入失败: {e}")
+        return report
+
+    def print_summary(self, top=8):
+        wall = time.time() - self.started
+        by_phase = {}
+        for (_, _, p), (c, t) in self.phases.items():
+            rec = by_phase.setdefault(p, [0, 0.0])
+            rec[0] += c
+            rec[1] += t
+        by_cmd = {}
+        for (_, _, _, cmd), (c, t, m) in self.commands.items():
+            rec = by_cmd.setdefault(cmd, [0, 0.0, 0.0])
+            rec[0] += c
+            rec[1] += t
+            rec[2] = max(rec[2], m)
+        print(f"\n[INFO] 耗时统计（总 {wall:.1f}s，详见 {TIMING_REPORT_FILE}）")
+        for p, (c, t) in sorted(by_phase.items(), key=lambda kv: -kv[1][1]):
+            print(f"  阶段 {p:<16} {c:>4} 次 {t:>8.1f}s")
+        for cmd, (c, t, m) in sorted(by_cmd.items(), key=lambda kv: -kv[1][1])[:top]:
+            print(f"  命令 {cmd:<30} {c:>5} 次 {t:>8.1f}s  平均 {t / c * 1000:>7.0f}ms  最大 {m:.1f}s")
+        means = {}
+        for prof, (c, ms, b, r, o) in self.page_loads.items():
+            means[prof] = (c, ms / c, b / c, o / c)
+            print(f"  页面 {prof:<12} {c:>4} 次  加载 {ms / c:>7.0f}ms  传输 {b / c / 1024:>7.0f}KB  "
+                  f"资源 {r / c:>5.0f} 个  打开 {o / c:>5.1f}s")
+        # 只比较同一种导航方式（当前标签页内 driver.get）下的 off 与拦截页面，样本太少时不下结论
+        base = means.get("off")
+        for prof, (c, ms, b, o) in means.items():
+            if prof in ("off", "reconnect") or not base:
+                continue
+            if min(base[0], c) < 2:
+                print(f"  拦截 {prof}: 基线或拦截样本少于 2 个，不计算节省量")
+                continue
+            print(f"  拦截 {prof} 相比基线（同为标签页内导航，基线 {base[0]} 页 / 拦截 {c} 页）: "
+                  f"每页加载节省 {base[1] - ms:.0f}ms，传输节省 {(base[2] - b) / 1024:.0f}KB，"
+                  f"打开节省 {base[3] - o:.1f}s")
+        if self.api_sources:
+            labels = {"capture": "页面捕获", "http": "HTTP", "browser": "浏览器内请求"}
+            print("  API 数据来源 " + " / ".join(
+                f"{labels.get(k, k)} {v} 次" for k, v in sorted(self.api_sources.items(), key=lambda kv: -kv[1])
+            ))
+
+
+RUN_TIMER = RunTimer()
+
+
+# ============================================================
+#  截图管理（内存截图、去重、后台压缩、每台服务器保留最近 N 帧）
+# ============================================================
+
+class ScreenshotManager:
+    def __init__(self):
+        self.ring_size = max(1, int(os.environ.get("WEIRDHOST_SCREENSHOT_RING", "3") or 3))
+        self.max_width = int(os.environ.get("WEIRDHOST_SCREENSHOT_MAX_WIDTH", "1280") or 1280)
+        self.out_dir = os.environ.get("WEIRDHOST_SCREENSHOT_DIR", ".")
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="weirdhost-shot")
+        self._lock = threading.Lock()
+        self._groups = {}
+        self._frames = {}
+        self.stats = {"captured": 0, "deduped": 0, "raw_bytes": 0, "encoded_bytes": 0, "written": 0}
+
+    def capture(self, sb, name, group=None):
+        if group is None:
+            group = "_".join(os.path.splitext(name)[0].split("_")[:2])
+        try:
+            png = sb.driver.get_screenshot_as_png()
+        except Exception as e:
+            print(f"[WARN]   截图失败: {e}")
+            return None
+        digest = hashlib.sha1(png).digest()
+        with self._lock:
+            ring = self._groups.setdefault(group, deque(maxlen=self.ring_size))
+            if ring and ring[-1]["digest"] == digest:
+                self._frames[name] = ring[-1]
+                self.stats["deduped"] += 1
+                return name
+            if len(ring) == ring.maxlen:
+                evicted = ring[0]
+                for key in [k for k, f in self._frames.items() if f is evicted]:
+                    del self._frames[key]
+            frame = {"digest": digest, "name": name, "path": None,
+                     "future": self._executor.submit(self._encode, png)}
+            ring.append(frame)
+            self._frames[name] = frame
+            self.stats["captured"] += 1
+            self.stats["raw_bytes"] += len(png)
+        return name
+
+    def _encode(self, png):
+        try:
+            from PIL import Image
+        except ImportError:
+            return png, ".png"
+        try:
+            img = Image.open(io.BytesIO(png))
+            if img.width > self.max_width:
+                img = img.resize((self.max_width, round(img.height * self.max_width / img.width)))
+            buf = io.BytesIO()
+            img.convert("RGB").save(buf, "JPEG", quality=70, optimize=True)
+            return buf.getvalue(), ".jpg"
+        except Exception:
+            return png, ".png"
+
+    def has(self, name):
+        return bool(name) and name in self._frames
+
+    def get(self, name):
+        frame = self._frames.get(name) if name else None
+        if frame is None:
+            return None
+        data, _ = frame["future"].result()
+        return data
+
+    def persist(self, names):
+        mapping = {}
+        for name in names:
+            frame = self._frames.get(name) if name else None
+            if frame is None:
+                continue
+            if frame["path"] is None:
+                data, ext = frame["future"].result()
+                path = os.path.join(self.out_dir, os.path.splitext(frame["name"])[0] + ext)
+                try:
+                    with open(path, "wb") as f:
+                        f.write(data)
+                except Exception as e:
+                    print(f"[WARN]   截图写入失败: {e}")
+                    continue
+                frame["path"] = path
+                with self._lock:
+                    self._frames[path] = frame
+                    self.stats["encoded_bytes"] += len(data)
+                    self.stats["written"] += 1
+            mapping[name] = frame["path"]
+        return mapping
+
+    def release(self, prefix):
+        # 账号结果落盘后丢弃它的全部帧，内存只随当前账号增长；之后按文件路径读取截图
+        with self._lock:
+            groups = [g for g in self._groups if g.startswith(prefix)]
+            frames = {id(f) for g in groups for f in self._groups.pop(g)}
+            for key in [k for k, f in self._frames.items() if id(f) in frames]:
+                del self._frames[key]
+
+
+SCREENSHOTS = ScreenshotManager()
+
+
+def take_screenshot(sb, name, group=None):
+    return SCREENSHOTS.capture(sb, name, group)
+
+
+def persist_result_screenshots(result):
+    items = [result] + list(result.get("servers", []))
+    mapping = SCREENSHOTS.persist([item.get("screenshot") for item in items])
+    for item in items:
+        if item.get("screenshot") in mapping:
+            item["screenshot"] = mapping[item["screenshot"]]
+    if "account_index" in result:
+        SCREENSHOTS.release(f"acc{result['account_index'] + 1}_")
+
+
 # ============================================================
 #  账号自动检测
 # ============================================================
@@ -186,10 +504,33 @@ def parse_account_config(raw_value):
     }
 
 
-def detect_accounts():
+COOKIE_ENV_PATTERN = re.compile(r"^WEIRDHOST_COOKIE_(\d+)$")
+ACCOUNTS_FILE = os.environ.get("WEIRDHOST_ACCOUNTS_FILE", "").strip()
+ACCOUNTS_DIR = os.environ.get("WEIRDHOST_ACCOUNTS_DIR", "").strip()
+ACCOUNTS_COOKIES = os.environ.get("WEIRDHOST_ACCOUNTS_COOKIES", ".weirdhost_cookies.enc").strip()
+FILE_COOKIE_BASES = {}
+
+
+def make_account(config, cookie_env, remark, source, path=None):
+    return {
+        "cookie_env": cookie_env,
+        "remark": remark,
+        "cookie_str": config["cookie_str"],
+        "cookie_name": config["cookie_name"],
+        "cookie_value": config["cookie_value"],
+        "source": source,
+        "path": path,
+    }
+
+
+def accounts_from_env():
     accounts = []
-    for i in range(1, MAX_COOKIE_COUNT + 1):
-        env_name = f"WEIRDHOST_COOKIE_{i}"
+    numbered = []
+    for name in os.environ:
+        m = COOKIE_ENV_PATTERN.match(name)
+        if m:
+            numbered.append((int(m.group(1)), name))
+    for i, env_name in sorted(numbered):
         raw = os.environ.get(env_name, "").strip()
         if not raw:
             continue
@@ -202,19 +543,356 @@ def detect_accounts():
 
         remark = config["remark"] or f"账号{i}"
         print(f"[INFO] 检测到 {env_name}: {mask_remark(remark)}")
+        accounts.append(make_account(config, env_name, remark, "env"))
+    return accounts
+
+
+def accounts_box():
+    material = os.environ.get("WEIRDHOST_ACCOUNTS_KEY", "").strip()
+    if not material or not nacl_available():
+        return None
+    from nacl import secret
+    return secret.SecretBox(hashlib.sha256(material.encode("utf-8")).digest())
+
+
+def encrypt_accounts_file(src, dst=None):
+    box = accounts_box()
+    if box is None:
+        raise SystemExit("[ERROR] 需要设置 WEIRDHOST_ACCOUNTS_KEY 并安装 pynacl")
+    dst = dst or f"{src}.enc"
+    with open(src, "rb") as f:
+        data = f.read()
+    with open(dst, "wb") as f:
+        f.write(base64.b64encode(box.encrypt(data)))
+    print(f"[INFO] 已加密 {src} -> {dst}")
+    return dst
+
+
+# 账号文件本身不改写（可能已加密提交到仓库），轮换后的 Cookie 加密保存在旁路文件里，
+# 记录对应的原始 Cookie；账号文件里的 Cookie 被手动更新后旁路记录自动失效
+def cookie_overrides_box():
+    box = accounts_box()
+    if box is None and nacl_available():
+        material = os.environ.get("WEIRDHOST_SESSION_KEY", "").strip()
+        if material:
+            from nacl import secret
+            box = secret.SecretBox(hashlib.sha256(material.encode("utf-8")).digest())
+    return box
+
+
+def load_cookie_overrides():
+    box = cookie_overrides_box()
+    if box is None or not os.path.exists(ACCOUNTS_COOKIES):
+        return {}
+    try:
+        with open(ACCOUNTS_COOKIES, "rb") as f:
+            return json.loads(box.decrypt(f.read()).decode("utf-8"))
+    except Exception:
+        print(f"[WARN] {ACCOUNTS_COOKIES} 无法解密，忽略已轮换的 Cookie")
+        return {}
+
+
+def write_account_file_cookie(secret_name, secret_value):
+    box = cookie_overrides_box()
+    if box is None:
+        print(f"[WARN]   {secret_name} 来自账号文件，未设置 WEIRDHOST_ACCOUNTS_KEY / WEIRDHOST_SESSION_KEY，"
+              f"无法保存新 Cookie，请手动更新账号文件")
+        return False
+    overrides = load_cookie_overrides()
+    overrides[secret_name[len("file:"):]] = {
+        "base": FILE_COOKIE_BASES.get(secret_name), "value": secret_value, "at": time.time(),
+    }
+    tmp = f"{ACCOUNTS_COOKIES}.tmp"
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(box.encrypt(json.dumps(overrides).encode("utf-8")))
+        os.replace(tmp, ACCOUNTS_COOKIES)
+        return True
+    except OSError as e:
+        print(f"[ERROR]  写回 {ACCOUNTS_COOKIES} 失败: {e}")
+        return False
 
-        accounts.append({
-            "index": i,
-            "cookie_env": env_name,
-            "remark": remark,
-            "cookie_str": config["cookie_str"],
-            "cookie_name": config["cookie_name"],
-            "cookie_value": config["cookie_value"],
-        })
 
+def read_accounts_file(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    fmt_path = path
+    if path.endswith(".enc"):
+        box = accounts_box()
+        if box is None:
+            print(f"[ERROR] {path} 已加密，但未设置 WEIRDHOST_ACCOUNTS_KEY 或缺少 pynacl")
+            return None
+        try:
+            data = box.decrypt(base64.b64decode(data))
+        except Exception:
+            print(f"[ERROR] {path} 解密失败，请检查 WEIRDHOST_ACCOUNTS_KEY")
+            return None
+        fmt_path = path[:-len(".enc")]
+    text = data.decode("utf-8")
+    if fmt_path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        return tomllib.loads(text)
+    return json.loads(text)
+
+
+def accounts_from_file(path):
+    try:
+        doc = read_accounts_file(path)
+    except Exception as e:
+        print(f"[ERROR] 账号文件 {path} 读取失败: {e}")
+        return []
+    if doc is None:
+        return []
+    entries = doc.get("accounts", []) if isinstance(doc, dict) else doc
+    overrides = load_cookie_overrides()
+    accounts = []
+    seen = set()
+    for n, entry in enumerate(entries, 1):
+        if isinstance(entry, str):
+            entry = {"cookie": entry}
+        config = parse_account_config(entry.get("cookie", ""))
+        if not config:
+            print(f"[WARN] 账号文件第 {n} 项格式错误，跳过")
+            continue
+        remark = entry.get("remark") or config["remark"] or f"账号{n}"
+        key = str(entry.get("id") or remark)
+        while key in seen:
+            key += "+"
+        seen.add(key)
+        base_cookie = config["cookie_str"]
+        override = overrides.get(key)
+        rotated = override and override.get("base") == base_cookie and parse_account_config(override.get("value", ""))
+        if rotated:
+            config = rotated
+        print(f"[INFO] 检测到账号文件项 {mask_remark(remark)}" + ("（使用已轮换的 Cookie）" if rotated else ""))
+        account = make_account(config, f"file:{key}", remark, "file")
+        account["base_cookie"] = base_cookie
+        accounts.append(account)
+    return accounts
+
+
+def accounts_from_dir(directory):
+    accounts = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError as e:
+        print(f"[ERROR] 账号目录 {directory} 读取失败: {e}")
+        return []
+    for name in names:
+        path = os.path.join(directory, name)
+        if name.startswith(".") or not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            config = parse_account_config(f.read())
+        if not config:
+            print(f"[WARN] 账号目录文件 {name} 格式错误，跳过")
+            continue
+        remark = config["remark"] or name
+        print(f"[INFO] 检测到账号目录文件 {name}: {mask_remark(remark)}")
+        accounts.append(make_account(config, f"dir:{name}", remark, "dir", path))
+    return accounts
+
+
+def detect_accounts():
+    accounts = accounts_from_env()
+    if ACCOUNTS_FILE:
+        accounts.extend(accounts_from_file(ACCOUNTS_FILE))
+    if ACCOUNTS_DIR:
+        accounts.extend(accounts_from_dir(ACCOUNTS_DIR))
+    for i, account in enumerate(accounts, 1):
+        account["index"] = i
     return accounts
 
 
+def write_account_dir_cookie(secret_name, secret_value):
+    path = os.path.join(ACCOUNTS_DIR, secret_name[len("dir:"):])
+    tmp = f"{path}.tmp"
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secret_value + "\n")
+        os.replace(tmp, path)
+        return True
+    except OSError as e:
+        print(f"[ERROR]  写回 {path} 失败: {e}")
+        return False
+
+
+# ============================================================
+#  分片与租约（多个任务并行时避免重复处理同一账号）
+# ============================================================
+
+LEASE_DIR = os.environ.get("WEIRDHOST_LEASE_DIR", ".weirdhost_lease")
+
+
+def parse_shard(value):
+    if not value:
+        return None
+    m = re.match(r"^\s*(\d+)\s*/\s*(\d+)\s*$", value)
+    if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        raise SystemExit(f"[ERROR] 无效的分片参数 {value!r}，格式为 i/N（1 ≤ i ≤ N）")
+    return int(m.group(1)), int(m.group(2))
+
+
+def shard_accounts(accounts, shard):
+    if not shard:
+        return accounts
+    index, total = shard
+    selected = [
+        a for a in accounts
+        if int(hashlib.sha1(a["cookie_env"].encode("utf-8")).hexdigest(), 16) % total == index - 1
+    ]
+    print(f"[INFO] 分片 {index}/{total}: {len(selected)}/{len(accounts)} 个账号")
+    return selected
+
+
+def lease_ttl_seconds():
+    try:
+        return float(os.environ.get("WEIRDHOST_LEASE_TTL_MINUTES", "").strip() or 45) * 60
+    except ValueError:
+        return 45 * 60
+
+
+def lease_path(account):
+    key = re.sub(r"[^A-Za-z0-9_.-]", "_", account["cookie_env"])
+    return os.path.join(LEASE_DIR, f"{key}.lease")
+
+
+def acquire_lease(account):
+    path = lease_path(account)
+    os.makedirs(LEASE_DIR, exist_ok=True)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            try:
+                age = time.time() - os.path.getmtime(path)
+            except OSError:
+                continue
+            if age < lease_ttl_seconds():
+                return None
+            print(f"[WARN] {mask_remark(account['remark'])} 的租约已过期 ({age / 60:.0f} 分钟)，接管")
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as f:
+            json.dump({"pid": os.getpid(), "host": os.uname().nodename, "at": time.time()}, f)
+        return path
+    return None
+
+
+def acquire_leases(pending):
+    leased = []
+    paths = []
+    for account_index, account in pending:
+        path = acquire_lease(account)
+        if path:
+            leased.append((account_index, account))
+            paths.append(path)
+        else:
+            print(f"[INFO] {mask_remark(account['remark'])} 正由其他任务处理，跳过")
+    return leased, paths
+
+
+def release_leases(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+# ============================================================
+#  后台异步分发（Telegram / GitHub 共用一个连接池）
+# ============================================================
+
+class AsyncDispatcher:
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._session = None
+        self._tg_lock = None
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="weirdhost-dispatcher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def get_session(self):
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10, ttl_dns_cache=600),
+                timeout=aiohttp.ClientTimeout(total=60),
+            )
+        return self._session
+
+    def tg_lock(self):
+        # 在分发线程内调用，保证 Telegram 消息按提交顺序发送
+        if self._tg_lock is None:
+            self._tg_lock = asyncio.Lock()
+        return self._tg_lock
+
+    def submit(self, coro):
+        fut = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        with self._pending_lock:
+            self._pending.add(fut)
+        fut.add_done_callback(self._discard)
+        return fut
+
+    def _discard(self, fut):
+        with self._pending_lock:
+            self._pending.discard(fut)
+
+    def flush(self, timeout=60):
+        with self._pending_lock:
+            pending = list(self._pending)
+        if not pending:
+            return
+        print(f"[INFO] 等待 {len(pending)} 个后台任务完成...")
+        _, not_done = futures_wait(pending, timeout=timeout)
+        if not_done:
+            print(f"[WARN] {len(not_done)} 个后台任务超时未完成")
+
+    def shutdown(self, timeout=60):
+        self.flush(timeout)
+        if self._session is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(timeout=10)
+            except Exception:
+                pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = AsyncDispatcher()
+        return _dispatcher
+
+
+def shutdown_dispatcher(timeout=60):
+    global _dispatcher
+    with _dispatcher_lock:
+        dispatcher, _dispatcher = _dispatcher, None
+    if dispatcher is not None:
+        dispatcher.shutdown(timeout)
+
+
 # ============================================================
 #  Telegram 通知
 # ============================================================
@@ -225,40 +903,58 @@ async def tg_notify(message):
     if not token or not chat_id:
         print("[INFO] 未配置 TG_BOT_TOKEN 或 TG_CHAT_ID，跳过通知")
         return
-    async with aiohttp.ClientSession() as session:
+    dispatcher = get_dispatcher()
+    session = await dispatcher.get_session()
+    async with dispatcher.tg_lock():
         try:
-            await session.post(
+            # 读完响应体，连接才会回到共享会话的连接池
+            async with session.post(
                 f"https://api.telegram.org/bot{token}/sendMessage",
                 json={"chat_id": chat_id, "text": message, "parse_mode": "HTML"}
-            )
+            ) as resp:
+                body = await resp.text()
+                if resp.status != 200:
+                    print(f"[ERROR] TG 发送失败: HTTP {resp.status} {body[:200]}")
         except Exception as e:
             print(f"[ERROR] TG 发送失败: {e}")
 
 
-async def tg_notify_photo(photo_path, caption=""):
+async def tg_notify_photo(photo, caption="", filename=None):
     token = os.environ.get("TG_BOT_TOKEN")
     chat_id = os.environ.get("TG_CHAT_ID")
-    if not token or not chat_id or not os.path.exists(photo_path):
+    if not token or not chat_id:
         return
-    async with aiohttp.ClientSession() as session:
+    if not isinstance(photo, bytes):
+        if not os.path.exists(photo):
+            return
+        filename = filename or os.path.basename(photo)
+    dispatcher = get_dispatcher()
+    session = await dispatcher.get_session()
+    async with dispatcher.tg_lock():
         try:
-            with open(photo_path, "rb") as f:
-                data = aiohttp.FormData()
-                data.add_field("chat_id", chat_id)
-                data.add_field("photo", f, filename=os.path.basename(photo_path))
-                data.add_field("caption", caption)
-                data.add_field("parse_mode", "HTML")
-                await session.post(f"https://api.telegram.org/bot{token}/sendPhoto", data=data)
+            if not isinstance(photo, bytes):
+                with open(photo, "rb") as f:
+                    photo = f.read()
+            import aiohttp
+            data = aiohttp.FormData()
+            data.add_field("chat_id", chat_id)
+            data.add_field("photo", photo, filename=filename or "screenshot.png")
+            data.add_field("caption", caption)
+            data.add_field("parse_mode", "HTML")
+            async with session.post(f"https://api.telegram.org/bot{token}/sendPhoto", data=data) as resp:
+                body = await resp.text()
+                if resp.status != 200:
+                    print(f"[ERROR] TG 图片发送失败: HTTP {resp.status} {body[:200]}")
         except Exception as e:
             print(f"[ERROR] TG 图片发送失败: {e}")
 
 
 def sync_tg_notify(message):
-    asyncio.run(tg_notify(message))
+    return get_dispatcher().submit(tg_notify(message))
 
 
-def sync_tg_notify_photo(photo_path, caption=""):
-    asyncio.run(tg_notify_photo(photo_path, caption))
+def sync_tg_notify_photo(photo, caption="", filename=None):
+    return get_dispatcher().submit(tg_notify_photo(photo, caption, filename))
 
 
 # ============================================================
@@ -266,51 +962,145 @@ def sync_tg_notify_photo(photo_path, caption=""):
 # ============================================================
 
 def encrypt_secret(public_key, secret_value):
+    from nacl import encoding, public
     pk = public.PublicKey(public_key.encode("utf-8"), encoding.Base64Encoder())
     sealed_box = public.SealedBox(pk)
     encrypted = sealed_box.encrypt(secret_value.encode("utf-8"))
     return base64.b64encode(encrypted).decode("utf-8")
 
 
-async def update_github_secret(secret_name, secret_value):
-    repo_token = os.environ.get("REPO_TOKEN", "").strip()
-    repository = os.environ.get("GITHUB_REPOSITORY", "").strip()
-    if not repo_token or not repository or not NACL_AVAILABLE:
-        return False
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"Bearer {repo_token}",
-        "X-GitHub-Api-Version": "2022-11-28",
-    }
-    async with aiohttp.ClientSession() as session:
+# 收集本次运行中变化的 Secret，运行结束时用缓存的公钥并发写入，同一个值只写一次
+class SecretWriter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._staged = {}
+        self._written = {}
+        self._public_key = None
+        self._key_lock = None
+
+    def stage(self, secret_name, secret_value):
+        with self._lock:
+            current = self._staged.get(secret_name, self._written.get(secret_name))
+            if current == secret_value:
+                return False
+            if self._written.get(secret_name) == secret_value:
+                self._staged.pop(secret_name, None)
+                return False
+            self._staged[secret_name] = secret_value
+            return True
+
+    def pending(self):
+        with self._lock:
+            return dict(self._staged)
+
+    def _headers(self, repo_token):
+        return {
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"Bearer {repo_token}",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+
+    async def _get_public_key(self, session, repository, headers):
+        if self._key_lock is None:
+            self._key_lock = asyncio.Lock()
+        async with self._key_lock:
+            if self._public_key is None:
+                pk_url = f"https://api.github.com/repos/{repository}/actions/secrets/public-key"
+                async with session.get(pk_url, headers=headers) as resp:
+                    if resp.status != 200:
+                        return None
+                    self._public_key = await resp.json()
+            return self._public_key
+
+    async def _write(self, session, repository, headers, secret_name, secret_value):
         try:
-            pk_url = f"https://api.github.com/repos/{repository}/actions/secrets/public-key"
-            async with session.get(pk_url, headers=headers) as resp:
-                if resp.status != 200:
-                    return False
-                pk_data = await resp.json()
+            pk_data = await self._get_public_key(session, repository, headers)
+            if not pk_data:
+                return False
             encrypted_value = encrypt_secret(pk_data["key"], secret_value)
             secret_url = f"https://api.github.com/repos/{repository}/actions/secrets/{secret_name}"
             async with session.put(secret_url, headers=headers, json={
                 "encrypted_value": encrypted_value, "key_id": pk_data["key_id"]
             }) as resp:
                 return resp.status in (201, 204)
-        except:
+        except Exception:
             return False
 
+    async def _write_all(self, items):
+        repo_token = os.environ.get("REPO_TOKEN", "").strip()
+        repository = os.environ.get("GITHUB_REPOSITORY", "").strip()
+        if not repo_token or not repository or not nacl_available():
+            return {name: False for name in items}
+        headers = self._headers(repo_token)
+        session = await get_dispatcher().get_session()
+        outcomes = await asyncio.gather(*(
+            self._write(session, repository, headers, name, value) for name, value in items.items()
+        ))
+        return dict(zip(items, outcomes))
+
+    def flush(self, timeout=60):
+        with self._lock:
+            items, self._staged = self._staged, {}
+        if not items:
+            return {}
+        outcomes = {}
+        remote = {}
+        for name, value in items.items():
+            if name.startswith("dir:"):
+                outcomes[name] = write_account_dir_cookie(name, value)
+            elif name.startswith("file:"):
+                outcomes[name] = write_account_file_cookie(name, value)
+            else:
+                remote[name] = value
+        if remote:
+            print(f"[INFO] 并发更新 {len(remote)} 个 GitHub Secret...")
+            try:
+                outcomes.update(get_dispatcher().submit(self._write_all(remote)).result(timeout=timeout))
+            except Exception as e:
+                print(f"[ERROR] GitHub Secret 更新异常: {e}")
+                outcomes.update({name: False for name in remote})
+        with self._lock:
+            for name, ok in outcomes.items():
+                if ok:
+                    print(f"[INFO]   ✅ {name} 已更新")
+                    self._written[name] = items[name]
+                else:
+                    print(f"[ERROR]  ❌ {name} 更新失败")
+                    self._staged.setdefault(name, items[name])
+        return outcomes
+
+
+SECRET_WRITER = SecretWriter()
+
+
+def stage_github_secret(secret_name, secret_value):
+    return SECRET_WRITER.stage(secret_name, secret_value)
+
+
+def flush_github_secrets(timeout=60):
+    return SECRET_WRITER.flush(timeout)
+
 
 # ============================================================
 #  基于 Selenium 的浏览器内 API 调用
 # ============================================================
 
-def api_fetch_json(sb, url, xsrf_token=None):
+BATCH_FETCH_CONCURRENCY = 4
+
+
+def api_headers(xsrf_token=None):
     headers = {
         "Accept": "application/json",
         "X-Requested-With": "XMLHttpRequest",
-        "Referer": f"https://{DOMAIN}/",
+        "Referer": f"{SITE_URL}/",
     }
     if xsrf_token:
         headers["X-XSRF-TOKEN"] = xsrf_token
+    return headers
+
+
+def api_fetch_json(sb, url, xsrf_token=None):
+    headers = api_headers(xsrf_token)
 
     script = """
         var done = arguments[arguments.length - 1];
@@ -331,6 +1121,42 @@ def api_fetch_json(sb, url, xsrf_token=None):
     return result
 
 
+def api_fetch_json_batch(sb, urls, xsrf_token=None, concurrency=BATCH_FETCH_CONCURRENCY):
+    if not urls:
+        return []
+    script = """
+        var done = arguments[arguments.length - 1];
+        var urls = arguments[0], headers = arguments[1], limit = arguments[2];
+        var results = new Array(urls.length), next = 0;
+        function worker() {
+            if (next >= urls.length) return Promise.resolve();
+            var i = next++;
+            return fetch(urls[i], {headers: headers})
+                .then(resp => {
+                    if (resp.status === 401) return {_error: 'unauthorized'};
+                    return resp.json();
+                })
+                .catch(err => ({_error: err.toString()}))
+                .then(data => { results[i] = data; return worker(); });
+        }
+        var workers = [];
+        for (var w = 0; w < Math.min(limit, urls.length); w++) workers.push(worker());
+        Promise.all(workers).then(() => done(results));
+    """
+    try:
+        results = sb.driver.execute_async_script(script, list(urls), api_headers(xsrf_token), concurrency)
+    except Exception as e:
+        print(f"[ERROR]   批量 fetch 失败: {e}")
+        return [None] * len(urls)
+    out = []
+    for url, result in zip(urls, results or [None] * len(urls)):
+        if isinstance(result, dict) and "_error" in result:
+            print(f"[ERROR]   fetch 失败: {result['_error']}")
+            result = None
+        out.append(result)
+    return out
+
+
 def get_xsrf_token_from_cookies(sb):
     try:
         cookies = sb.get_cookies()
@@ -343,109 +1169,852 @@ def get_xsrf_token_from_cookies(sb):
 
 
 # ============================================================
-#  Turnstile 处理（登录阶段）
+#  页面响应捕获（复用 SPA 自己加载的 /api/client/* 数据，缺失或过期时才重新请求）
 # ============================================================
 
-def ts_exists(sb):
+def capture_enabled():
+    return os.environ.get("WEIRDHOST_CAPTURE", "1").strip() != "0"
+
+
+def capture_max_age():
+    return env_float("WEIRDHOST_CAPTURE_MAX_AGE", 300)
+
+
+# 浏览器以 performance 日志启动（SB(log_cdp=True)），从 Network.responseReceived / loadingFinished
+# 找到 /api/client/ 的 JSON 响应，再用 Network.getResponseBody 取响应体。页面跳转后旧页面的响应体会被释放，
+# 所以每次页面打开后立即 drain。uc_open_with_reconnect 断开驱动期间的请求收不到，只能回退为重新请求
+class ResponseCapture:
+    def __init__(self):
+        self.usable = capture_enabled()
+        self.entries = {}
+        self.not_before = {}
+        self._pending = {}
+
+    @staticmethod
+    def key(url):
+        parsed = urlparse(url)
+        query = "&".join(sorted(parsed.query.split("&"))) if parsed.query else ""
+        return f"{parsed.netloc}{parsed.path.rstrip('/')}?{query}"
+
+    def drain(self, sb):
+        if not self.usable or sb is None:
+            return 0
+        try:
+            logs = sb.driver.get_log("performance")
+        except Exception as e:
+            print(f"[WARN]   performance 日志不可用，关闭页面响应捕获: {e}")
+            self.usable = False
+            return 0
+        finished = []
+        for entry in logs:
+            try:
+                msg = json.loads(entry["message"])["message"]
+            except Exception:
+                continue
+            params = msg.get("params") or {}
+            if msg.get("method") == "Network.responseReceived":
+                response = params.get("response") or {}
+                if (response.get("status") == 200 and "/api/client" in response.get("url", "")
+                        and "json" in (response.get("mimeType") or "")):
+                    self._pending[params.get("requestId")] = response["url"]
+            elif msg.get("method") == "Network.loadingFinished" and params.get("requestId") in self._pending:
+                finished.append(params["requestId"])
+        captured = 0
+        for request_id in finished:
+            url = self._pending.pop(request_id)
+            try:
+                body = sb.driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+                text = body.get("body", "")
+                if body.get("base64Encoded"):
+                    text = base64.b64decode(text).decode("utf-8", "replace")
+                data = json.loads(text)
+            except Exception:
+                continue
+            self.entries[self.key(url)] = (time.time(), data)
+            captured += 1
+        return captured
+
+    def peek(self, url, max_age=None):
+        if not self.usable:
+            return None
+        k = self.key(url)
+        hit = self.entries.get(k)
+        if not hit:
+            return None
+        captured_at, data = hit
+        if captured_at < self.not_before.get(k, 0):
+            return None
+        if time.time() - captured_at > (capture_max_age() if max_age is None else max_age):
+            return None
+        return data
+
+    def lookup(self, sb, url, max_age=None):
+        if not self.usable:
+            return None
+        self.drain(sb)
+        return self.peek(url, max_age)
+
+    def invalidate(self, sb, url):
+        # 续期等写操作之后调用：之前捕获的数据作废，只接受之后 SPA 重新加载的响应
+        self.drain(sb)
+        self.not_before[self.key(url)] = time.time()
+
+    def reset(self, sb=None):
+        # 切换账号时丢弃上一个账号的数据（URL 相同，内容属于不同会话）
+        self.drain(sb)
+        self.entries.clear()
+        self.not_before.clear()
+        self._pending.clear()
+
+
+CAPTURE = ResponseCapture()
+
+
+# ============================================================
+#  浏览器外 HTTP 快速通道（复用浏览器会话 Cookie）
+# ============================================================
+
+SESSION_DIR = os.environ.get("WEIRDHOST_SESSION_DIR", ".weirdhost_session")
+DEFAULT_USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+)
+CHALLENGE_MARKERS = ("Just a moment", "cf-chl", "challenges.cloudflare.com", "cf_chl_opt")
+
+
+def http_enabled():
+    return os.environ.get("WEIRDHOST_HTTP", "1").strip() != "0"
+
+
+def server_info_url(server_uuid, server_type):
+    ep = f"/freeservers/{server_uuid}/info" if server_type == "free" else f"/notfreeservers/{server_uuid}/info"
+    return f"{API_BASE_URL}{ep}"
+
+
+class HttpApiClient:
+    def __init__(self, cookies, user_agent=None, pool_size=8):
+        self.cookies = dict(cookies)
+        self.user_agent = user_agent or DEFAULT_USER_AGENT
+        self.pool_size = pool_size
+        self.usable = True
+        self._loop = asyncio.new_event_loop()
+        self._session = None
+
+    @property
+    def xsrf_token(self):
+        token = self.cookies.get("XSRF-TOKEN")
+        return unquote(token) if token else None
+
+    def _headers(self):
+        headers = {
+            "Accept": "application/json",
+            "X-Requested-With": "XMLHttpRequest",
+            "Referer": f"{SITE_URL}/",
+            "User-Agent": self.user_agent,
+            "Cookie": "; ".join(f"{k}={v}" for k, v in self.cookies.items()),
+        }
+        if self.xsrf_token:
+            headers["X-XSRF-TOKEN"] = self.xsrf_token
+        return headers
+
+    async def _ensure_session(self):
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=20),
+            )
+        return self._session
+
+    async def _fetch(self, url):
+        session = await self._ensure_session()
+        try:
+            async with session.get(url, headers=self._headers(), allow_redirects=False) as resp:
+                for name, morsel in resp.cookies.items():
+                    self.cookies[name] = morsel.value
+                body = await resp.text()
+                if resp.status in (401, 403):
+                    if any(m in body for m in CHALLENGE_MARKERS):
+                        return ("challenge", None)
+                    return ("auth", None)
+                if resp.status in (301, 302) and "/login" in resp.headers.get("Location", ""):
+                    return ("auth", None)
+                if "json" not in resp.headers.get("Content-Type", ""):
+                    if any(m in body for m in CHALLENGE_MARKERS):
+                        return ("challenge", None)
+                    return ("error", f"HTTP {resp.status} 非 JSON 响应")
+                if resp.status != 200:
+                    return ("error", f"HTTP {resp.status}")
+                return ("ok", json.loads(body))
+        except Exception as e:
+            return ("error", repr(e))
+
+    def get_json(self, url):
+        return self._loop.run_until_complete(self._fetch(url))
+
+    def get_json_many(self, urls, concurrency=BATCH_FETCH_CONCURRENCY):
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(url):
+            async with sem:
+                return await self._fetch(url)
+
+        async def run():
+            return await asyncio.gather(*(one(u) for u in urls))
+
+        return self._loop.run_until_complete(run())
+
+    def close(self):
+        try:
+            if self._session is not None:
+                self._loop.run_until_complete(self._session.close())
+        except Exception:
+            pass
+        self._session = None
+        self._loop.close()
+
+
+def api_get_json(sb, url, xsrf_token=None, http=None):
+    data = CAPTURE.lookup(sb, url)
+    if data is not None:
+        RUN_TIMER.record_api("capture")
+        return data
+    if http is not None and http.usable:
+        kind, data = http.get_json(url)
+        if kind == "ok":
+            RUN_TIMER.record_api("http")
+            return data
+        if kind in ("auth", "challenge"):
+            print(f"[WARN]   HTTP 通道被拒绝 ({kind})，回退到浏览器内请求")
+            http.usable = False
+        else:
+            print(f"[ERROR]   HTTP 请求失败: {data}")
+            return None
+    if sb is None:
+        return None
+    RUN_TIMER.record_api("browser")
+    return api_fetch_json(sb, url, xsrf_token)
+
+
+def api_get_json_many(sb, urls, xsrf_token=None, http=None):
+    results = [None] * len(urls)
+    CAPTURE.drain(sb)
+    pending = []
+    for i, url in enumerate(urls):
+        results[i] = CAPTURE.peek(url)
+        if results[i] is None:
+            pending.append(i)
+    if len(pending) < len(urls):
+        RUN_TIMER.record_api("capture", len(urls) - len(pending))
+    if http is not None and http.usable and pending:
+        fetched = http.get_json_many([urls[i] for i in pending])
+        rejected = []
+        for i, (kind, data) in zip(pending, fetched):
+            if kind == "ok":
+                results[i] = data
+                RUN_TIMER.record_api("http")
+            elif kind in ("auth", "challenge"):
+                rejected.append(i)
+            else:
+                print(f"[ERROR]   HTTP 请求失败: {data}")
+        pending = rejected
+        if pending:
+            print(f"[WARN]   HTTP 通道被拒绝，{len(pending)} 个请求回退到浏览器内批量请求")
+            http.usable = False
+    if sb is not None and pending:
+        RUN_TIMER.record_api("browser", len(pending))
+        batch = api_fetch_json_batch(sb, [urls[i] for i in pending], xsrf_token)
+        for i, data in zip(pending, batch):
+            results[i] = data
+    return results
+
+
+def fetch_server_infos(sb, servers, xsrf_token=None, http=None):
+    targets = [s for s in servers if s.get("uuid") and s.get("server_type") in ("notfree", "free")]
+    urls = [server_info_url(s["uuid"], s["server_type"]) for s in targets]
+    infos = {}
+    for s, si in zip(targets, api_get_json_many(sb, urls, xsrf_token, http)):
+        if si and si.get("success"):
+            infos[s["uuid"]] = si.get("data", {})
+    return infos
+
+
+def session_file_path(account):
+    key = re.sub(r"[^A-Za-z0-9_.-]", "_", account.get("cookie_env") or account.get("remark", "account"))
+    return os.path.join(SESSION_DIR, f"{key}.enc")
+
+
+def session_box(account):
+    if not nacl_available():
+        return None
+    from nacl import secret
+    material = os.environ.get("WEIRDHOST_SESSION_KEY", "").strip()
+    if not material:
+        material = f"{account.get('cookie_name', '')}={account.get('cookie_value', '')}"
+    return secret.SecretBox(hashlib.sha256(material.encode("utf-8")).digest())
+
+
+def session_ttl_seconds():
     try:
-        return sb.execute_script("""
-            return !!(
-                document.querySelector('input[name="cf-turnstile-response"]') ||
-                document.querySelector('.cf-turnstile') ||
-                document.querySelector('iframe[src*="challenges.cloudflare.com"]')
-            );
-        """)
-    except:
-        return False
+        return float(os.environ.get("WEIRDHOST_SESSION_TTL_HOURS", "24").strip() or 24) * 3600
+    except ValueError:
+        return 24 * 3600
 
 
-def ts_solved(sb):
+def capture_browser_session(sb):
     try:
-        return sb.execute_script("""
-            var i = document.querySelector('input[name="cf-turnstile-response"]');
-            return i && i.value && i.value.length > 20;
-        """)
-    except:
-        return False
+        cookies = {}
+        cookie_list = []
+        for c in sb.get_cookies():
+            if DOMAIN.endswith(c.get("domain", "").lstrip(".")):
+                cookies[c["name"]] = c.get("value", "")
+                cookie_list.append(c)
+        user_agent = sb.execute_script("return navigator.userAgent;")
+        return {"cookies": cookies, "cookie_list": cookie_list,
+                "user_agent": user_agent, "saved_at": time.time()}
+    except Exception as e:
+        print(f"[WARN]   会话 Cookie 读取失败: {e}")
+        return None
 
 
-def expand_turnstile(sb):
+def save_session_state(account, session_state):
+    box = session_box(account)
+    if not session_state or not box:
+        return
     try:
-        sb.execute_script("""
-            (function() {
-                var ti = document.querySelector('input[name="cf-turnstile-response"]');
-                if (!ti) return;
-                var el = ti;
-                for (var i = 0; i < 20; i++) {
-                    el = el.parentElement;
-                    if (!el) break;
-                    var s = window.getComputedStyle(el);
-                    if (s.overflow === 'hidden') el.style.overflow = 'visible';
-                    el.style.minWidth = 'max-content';
-                }
-                document.querySelectorAll('.cf-turnstile').forEach(function(c) {
-                    c.style.overflow = 'visible';
-                    c.style.width = '300px';
-                    c.style.height = '65px';
-                });
-                document.querySelectorAll('iframe').forEach(function(f) {
-                    if (f.src && f.src.includes('challenges.cloudflare.com')) {
-                        f.style.width = '300px';
-                        f.style.height = '65px';
-                        f.style.visibility = 'visible';
-                        f.style.opacity = '1';
-                    }
-                });
-            })();
-        """)
-    except:
-        pass
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        path = session_file_path(account)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(box.encrypt(json.dumps(session_state).encode("utf-8")))
+    except Exception as e:
+        print(f"[WARN]   会话保存失败: {e}")
 
 
-def focus_turnstile_area(sb):
+def load_session_state(account):
+    path = session_file_path(account)
+    box = session_box(account)
+    if not box or not os.path.exists(path):
+        return None
     try:
-        sb.execute_script("""
-            const selectors = [
-                '.cf-turnstile',
-                'iframe[src*="challenges.cloudflare"]',
-                'input[name="cf-turnstile-response"]',
-                'label.cb-lb',
-                '.cb-lb',
-                'input[type="checkbox"]'
-            ];
-            for (const selector of selectors) {
-                const el = document.querySelector(selector);
-                if (el) {
-                    el.scrollIntoView({block: 'center', inline: 'center'});
-                    return true;
-                }
-            }
-            window.scrollTo(0, Math.max(0, document.body.scrollHeight * 0.45));
-            return false;
-        """)
-        time.sleep(0.5)
-    except:
-        pass
+        with open(path, "rb") as f:
+            session_state = json.loads(box.decrypt(f.read()).decode("utf-8"))
+    except Exception:
+        print(f"[WARN]   会话缓存无法解密，已丢弃")
+        drop_session_state(account)
+        return None
+    if time.time() - session_state.get("saved_at", 0) > session_ttl_seconds():
+        print(f"[INFO]   会话缓存已过期，已丢弃")
+        drop_session_state(account)
+        return None
+    return session_state
 
 
-def handle_turnstile(sb, timeout=120):
-    if not ts_exists(sb):
-        return True
-    print("[INFO]   检测到 Turnstile，尝试自动解决...")
+def drop_session_state(account):
     try:
-        sb.uc_gui_handle_captcha()
-        if ts_solved(sb) or not ts_exists(sb):
-            print("[INFO]   自动解决成功 ✅")
-            return True
-    except:
+        os.remove(session_file_path(account))
+    except OSError:
         pass
 
-    print("[INFO]   自动解决未完成，进入手动处理 ...")
-    start = time.time()
-    last_action = 0
-    while time.time() - start < timeout:
-        if ts_solved(sb):
-            print("[INFO]   Turnstile 令牌已生成 ✅")
+
+# cf_clearance 绑定签发时的 User-Agent。Network.setUserAgentOverride 只作用于当前标签页，
+# 而 uc_open_with_reconnect 每次都会新开标签页，所以 UA 只能在启动 Chrome 时通过 SB(agent=...) 指定
+def session_user_agent(indexed_accounts):
+    for _, account in indexed_accounts:
+        session_state = load_session_state(account)
+        if session_state and session_state.get("user_agent"):
+            return session_state["user_agent"]
+    return None
+
+
+def restorable_cookie_params(sb, session_state):
+    params = session_cookie_params(session_state)
+    ua = (session_state or {}).get("user_agent")
+    if ua and ua != sb.execute_script("return navigator.userAgent;"):
+        print(f"[WARN]   会话缓存的 User-Agent 与当前浏览器不一致，不恢复 cf_clearance")
+        params = [c for c in params if c["name"] != "cf_clearance"]
+    return params
+
+
+def restore_browser_session(sb, session_state):
+    if not session_state or not session_state.get("cookie_list"):
+        return False
+    try:
+        for params in restorable_cookie_params(sb, session_state):
+            sb.driver.execute_cdp_cmd("Network.setCookie", params)
+        return True
+    except Exception as e:
+        print(f"[WARN]   会话缓存恢复失败: {e}")
+        return False
+
+
+def open_http_client(session_state, account=None):
+    if not http_enabled() or not session_state or not session_state.get("cookies"):
+        return None
+    cookies = dict(session_state["cookies"])
+    if account and account.get("cookie_name") and account["cookie_name"] not in cookies:
+        cookies[account["cookie_name"]] = account.get("cookie_value", "")
+    return HttpApiClient(cookies, session_state.get("user_agent"))
+
+
+# ============================================================
+#  页面内辅助函数库（每个文档只注入一次 window.__wh，之后每次调用只发送很短的脚本）
+# ============================================================
+
+WH_VERSION = 2
+WH_HELPERS_JS = """
+(function() {
+    if (window.__wh && window.__wh.version === __WH_VERSION__) return 'exists';
+    var TOKEN_SELECTOR = 'input[name="cf-turnstile-response"]';
+
+    function tokenInput() { return document.querySelector(TOKEN_SELECTOR); }
+    function tokenState() {
+        var t = tokenInput();
+        if (!t) return 'idle';
+        return (t.value && t.value.length > 20) ? 'solved' : 'turnstile';
+    }
+    function turnstilePresent() {
+        return !!(tokenInput() || document.querySelector('.cf-turnstile') ||
+                  document.querySelector('iframe[src*="challenges.cloudflare.com"]'));
+    }
+    function byXpath(xp) {
+        try {
+            return document.evaluate(xp, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        } catch (e) { return null; }
+    }
+    function classifyResult() {
+        var buttons = document.querySelectorAll('button');
+        var hasNextBtn = false;
+        for (var i = 0; i < buttons.length; i++) {
+            if (buttons[i].innerText.includes('NEXT') || buttons[i].innerText.includes('Next')) {
+                hasNextBtn = true; break;
+            }
+        }
+        var bodyText = document.body ? (document.body.innerText || '') : '';
+        var hasSuccessTitle = bodyText.includes('Success');
+        var hasSuccessContent = bodyText.includes('성공') || bodyText.includes('갱신') || bodyText.includes('연장');
+        var hasCooldown = bodyText.includes('아직') || bodyText.includes('Error');
+        if (hasNextBtn || hasSuccessTitle) {
+            if (hasCooldown && bodyText.includes('아직')) return 'cooldown';
+            if (hasSuccessTitle && hasSuccessContent) return 'success';
+            if (hasNextBtn) {
+                if (hasCooldown) return 'cooldown';
+                if (hasSuccessContent) return 'success';
+            }
+        }
+        return null;
+    }
+    function unclipTokenParents(checkAxes) {
+        var el = tokenInput();
+        if (!el) return false;
+        for (var i = 0; i < 20; i++) {
+            el = el.parentElement;
+            if (!el) break;
+            var s = window.getComputedStyle(el);
+            if (s.overflow === 'hidden' || (checkAxes && (s.overflowX === 'hidden' || s.overflowY === 'hidden'))) {
+                el.style.overflow = 'visible';
+            }
+            el.style.minWidth = 'max-content';
+        }
+        return true;
+    }
+    function sizeTurnstileIframes(minWidth) {
+        document.querySelectorAll('iframe').forEach(function(f) {
+            if (f.src && f.src.includes('challenges.cloudflare.com')) {
+                f.style.width = '300px';
+                f.style.height = '65px';
+                if (minWidth) f.style.minWidth = '300px';
+                f.style.visibility = 'visible';
+                f.style.opacity = '1';
+            }
+        });
+    }
+    function rectCoords(rect) {
+        return {x: rect.x, y: rect.y, width: rect.width, height: rect.height,
+                click_x: Math.round(rect.x + 30), click_y: Math.round(rect.y + rect.height / 2)};
+    }
+
+    var wh = {version: __WH_VERSION__};
+
+    wh.tsExists = turnstilePresent;
+    wh.tokenState = tokenState;
+    wh.classifyResult = classifyResult;
+
+    // 登录页的 Turnstile
+    wh.expandTurnstile = function() {
+        if (!unclipTokenParents(false)) return false;
+        document.querySelectorAll('.cf-turnstile').forEach(function(c) {
+            c.style.overflow = 'visible';
+            c.style.width = '300px';
+            c.style.height = '65px';
+        });
+        sizeTurnstileIframes(false);
+        return true;
+    };
+
+    // 续期弹窗里的 Turnstile（容器被 styled-components 裁剪）
+    wh.expandPopup = function() {
+        if (!unclipTokenParents(true)) return 'no turnstile input';
+        document.querySelectorAll('[class*="sc-fKFyDc"], [class*="nwOmR"]').forEach(function(container) {
+            container.style.overflow = 'visible';
+            container.style.width = '300px';
+            container.style.minWidth = '300px';
+            container.style.height = '65px';
+        });
+        sizeTurnstileIframes(true);
+        return 'done';
+    };
+
+    wh.focusTurnstile = function() {
+        var selectors = ['.cf-turnstile', 'iframe[src*="challenges.cloudflare"]', TOKEN_SELECTOR,
+                         'label.cb-lb', '.cb-lb', 'input[type="checkbox"]'];
+        for (var i = 0; i < selectors.length; i++) {
+            var el = document.querySelector(selectors[i]);
+            if (el) {
+                el.scrollIntoView({block: 'center', inline: 'center'});
+                return true;
+            }
+        }
+        window.scrollTo(0, Math.max(0, document.body.scrollHeight * 0.45));
+        return false;
+    };
+
+    wh.checkboxCoords = function() {
+        var iframes = document.querySelectorAll('iframe');
+        for (var i = 0; i < iframes.length; i++) {
+            var src = iframes[i].src || '';
+            if (src.includes('cloudflare') || src.includes('turnstile')) {
+                var rect = iframes[i].getBoundingClientRect();
+                if (rect.width > 0 && rect.height > 0) return rectCoords(rect);
+            }
+        }
+        var input = tokenInput();
+        if (input) {
+            var container = input.parentElement;
+            for (var j = 0; j < 5; j++) {
+                if (!container) break;
+                var r = container.getBoundingClientRect();
+                if (r.width > 100 && r.height > 30) return rectCoords(r);
+                container = container.parentElement;
+            }
+        }
+        return null;
+    };
+
+    wh.windowInfo = function() {
+        return {screenX: window.screenX || 0, screenY: window.screenY || 0,
+                outerHeight: window.outerHeight, innerHeight: window.innerHeight};
+    };
+
+    wh.probe = function(selectors) {
+        var html = document.documentElement ? document.documentElement.outerHTML : '';
+        var m = html.match(/유통기한\\s*(\\d{4}-\\d{2}-\\d{2}\\s+\\d{2}:\\d{2}:\\d{2})/) ||
+                html.match(/(\\d{4}-\\d{2}-\\d{2}\\s+\\d{2}:\\d{2}:\\d{2})/);
+        var buttonIndex = -1, buttonDisabled = null;
+        for (var i = 0; i < selectors.length; i++) {
+            var btn = byXpath(selectors[i]);
+            if (btn) {
+                buttonIndex = i;
+                buttonDisabled = !!(btn.disabled || btn.getAttribute('aria-disabled') === 'true'
+                                    || btn.classList.contains('disabled'));
+                break;
+            }
+        }
+        return {
+            url: location.href,
+            expiry: m ? m[1].trim() : 'Unknown',
+            button_index: buttonIndex,
+            button_disabled: buttonDisabled,
+            server_controls: !!byXpath("//div[contains(@class,'ServerControls')]"),
+            server_link: !!byXpath("//a[contains(@href,'/server/')]"),
+            turnstile: turnstilePresent(),
+            challenge: /Just a moment/i.test(document.title || '') || !!window._cf_chl_opt,
+            ready_state: document.readyState
+        };
+    };
+
+    wh.metrics = function() {
+        var nav = performance.getEntriesByType('navigation')[0];
+        var res = performance.getEntriesByType('resource');
+        var bytes = nav ? (nav.transferSize || 0) : 0;
+        for (var i = 0; i < res.length; i++) bytes += res[i].transferSize || 0;
+        var load = nav && nav.loadEventEnd ? nav.loadEventEnd
+                 : (nav && nav.domContentLoadedEventEnd ? nav.domContentLoadedEventEnd : performance.now());
+        return {load_ms: Math.round(load), bytes: bytes, resources: res.length};
+    };
+
+    wh.challengeText = function() {
+        return (document.title || '') + ' ' + (window._cf_chl_opt ? 'cf_chl_opt' : '') +
+               (document.querySelector('iframe[src*="challenges.cloudflare.com"]') ? ' challenges.cloudflare.com' : '');
+    };
+
+    // 包装 fetch / XHR，记录弹窗发出的续期请求（非 GET 的 freeservers / notfreeservers 调用）及其 JSON 响应。
+    // 直接提交后，弹窗自己用同一个令牌再发的 fetch 复用这次的响应，避免重复调用续期接口
+    wh.hookRenew = function() {
+        if (window.__whRenewHook) return 'exists';
+        var hook = {calls: [], shared: null};
+        var pattern = /\\/(not)?freeservers\\//;
+        function wanted(url, method) {
+            return pattern.test(url) && String(method || 'GET').toUpperCase() !== 'GET';
+        }
+        function absolute(url) {
+            try { return new URL(url, location.href).href; } catch (e) { return String(url); }
+        }
+        function record(entry, status, text) {
+            entry.status = status;
+            try { entry.json = JSON.parse(text); } catch (e) { entry.text = String(text || '').slice(0, 500); }
+            entry.done = true;
+            var st = window.__whPopupState;
+            if (st && st.notify) st.notify();
+        }
+        function track(url, method, body) {
+            var entry = {url: absolute(url), method: String(method).toUpperCase(),
+                         body: typeof body === 'string' ? body : null, done: false, t: Date.now()};
+            hook.calls.push(entry);
+            return entry;
+        }
+        var origFetch = window.fetch;
+        window.fetch = function(input, init) {
+            var url = typeof input === 'string' ? input : (input && input.url) || '';
+            var method = (init && init.method) || (input && input.method) || 'GET';
+            if (!wanted(url, method)) return origFetch.apply(this, arguments);
+            if (hook.shared) return hook.shared.then(function(r) { return r.clone(); });
+            var entry = track(url, method, init && init.body);
+            var p = origFetch.apply(this, arguments);
+            p.then(function(r) {
+                return r.clone().text().then(function(t) { record(entry, r.status, t); });
+            }).catch(function(e) { record(entry, 0, String(e)); });
+            return p;
+        };
+        hook.fetch = origFetch;
+        var open = XMLHttpRequest.prototype.open, send = XMLHttpRequest.prototype.send;
+        XMLHttpRequest.prototype.open = function(method, url) {
+            this.__whMeta = {method: method, url: url};
+            return open.apply(this, arguments);
+        };
+        // submitRenewal 已直接提交时，弹窗自己的 XHR（axios）不再发出，改为回放同一个响应，避免同一令牌提交两次
+        function replay(xhr, status, text) {
+            var response = text;
+            if (xhr.responseType === 'json') {
+                try { response = JSON.parse(text); } catch (e) { response = null; }
+            }
+            var props = {readyState: 4, status: status, statusText: status === 200 ? 'OK' : '',
+                         responseText: text, response: response, responseURL: absolute(xhr.__whMeta.url)};
+            Object.keys(props).forEach(function(k) {
+                Object.defineProperty(xhr, k, {value: props[k], configurable: true});
+            });
+            xhr.getAllResponseHeaders = function() { return 'content-type: application/json\\r\\n'; };
+            xhr.getResponseHeader = function(n) { return /^content-type$/i.test(n) ? 'application/json' : null; };
+            (status ? ['readystatechange', 'load', 'loadend'] : ['readystatechange', 'error', 'loadend'])
+                .forEach(function(type) { xhr.dispatchEvent(new Event(type)); });
+        }
+        XMLHttpRequest.prototype.send = function(body) {
+            var meta = this.__whMeta;
+            if (meta && wanted(meta.url, meta.method)) {
+                if (hook.shared) {
+                    var xhr = this;
+                    hook.shared.then(function(r) {
+                        return r.clone().text().then(function(t) { replay(xhr, r.status, t); });
+                    }).catch(function() { replay(xhr, 0, ''); });
+                    return;
+                }
+                var entry = track(meta.url, meta.method, body);
+                this.addEventListener('loadend', function() { record(entry, this.status, this.responseText); });
+            }
+            return send.apply(this, arguments);
+        };
+        window.__whRenewHook = hook;
+        window.__whRenewCalls = hook.calls;
+        return 'installed';
+    };
+
+    wh.watchPopup = function() {
+        wh.hookRenew();
+        if (window.__whPopupState) return 'exists';
+        var st = {state: 'idle', version: 0, history: [], waiters: []};
+        st.notify = function() {
+            var waiters = st.waiters;
+            st.waiters = [];
+            waiters.forEach(function(w) { w(); });
+        };
+        function setState(s) {
+            if (s === st.state) return;
+            st.state = s;
+            st.version++;
+            st.history.push({state: s, t: Date.now()});
+            st.notify();
+        }
+        st.update = function() { setState(classifyResult() || tokenState()); };
+        var scheduled = false;
+        new MutationObserver(function() {
+            if (scheduled) return;
+            scheduled = true;
+            setTimeout(function() { scheduled = false; st.update(); }, 50);
+        }).observe(document.documentElement, {
+            childList: true, subtree: true, characterData: true,
+            attributes: true, attributeFilter: ['class', 'style', 'disabled', 'value']
+        });
+        // 令牌写入的是 value 属性而非 DOM attribute，MutationObserver 感知不到，单独低频检查
+        setInterval(function() {
+            if (st.state === 'turnstile' && tokenState() === 'solved') st.update();
+        }, 250);
+        window.__whPopupState = st;
+        st.update();
+        return 'installed';
+    };
+
+    // 'api' 表示续期接口已返回（由 hookRenew 记录）
+    wh.waitState = function(states, timeoutMs, done) {
+        var st = window.__whPopupState;
+        if (!st) { done({missing: true}); return; }
+        function renewCall() {
+            var calls = window.__whRenewCalls || [];
+            for (var i = calls.length - 1; i >= 0; i--) if (calls[i].done) return calls[i];
+            return null;
+        }
+        function matched() {
+            return states.indexOf(st.state) >= 0 || (states.indexOf('api') >= 0 && !!renewCall());
+        }
+        function snapshot(timedOut) {
+            return {state: st.state, version: st.version, history: st.history, timeout: timedOut, renew: renewCall()};
+        }
+        st.update();
+        if (matched()) { done(snapshot(false)); return; }
+        var finished = false;
+        var timer = setTimeout(function() { finished = true; done(snapshot(true)); }, timeoutMs);
+        function waiter() {
+            if (finished) return;
+            if (matched()) { finished = true; clearTimeout(timer); done(snapshot(false)); }
+            else st.waiters.push(waiter);
+        }
+        st.waiters.push(waiter);
+    };
+
+    // 用弹窗里已通过的 Turnstile 令牌直接调用续期接口；弹窗自己已经发出请求时只等它的响应
+    wh.submitRenewal = function(path, method, bodyKey, timeoutMs, done) {
+        var hook = window.__whRenewHook;
+        var calls = window.__whRenewCalls || [];
+        var finished = false;
+        function finish(r) { if (!finished) { finished = true; clearTimeout(timer); done(r); } }
+        function latest() {
+            for (var i = calls.length - 1; i >= 0; i--) if (calls[i].url.indexOf(path) >= 0) return calls[i];
+            return null;
+        }
+        var timer = setTimeout(function() { finish(latest() || {status: 0, text: 'timeout'}); }, timeoutMs);
+        var own = latest();
+        if (own) {
+            (function poll() { if (own.done) finish(own); else if (!finished) setTimeout(poll, 100); })();
+            return;
+        }
+        var input = tokenInput();
+        var token = input ? input.value : '';
+        if (!token) { finish({status: 0, text: 'no token'}); return; }
+        var m = document.cookie.match(/XSRF-TOKEN=([^;]+)/);
+        var body = {};
+        body[bodyKey] = token;
+        var entry = {url: new URL(path, location.href).href, method: method, body: null, done: false, t: Date.now()};
+        calls.push(entry);
+        var p = (hook && hook.fetch ? hook.fetch : fetch).call(window, path, {
+            method: method,
+            credentials: 'include',
+            headers: {'Content-Type': 'application/json', 'Accept': 'application/json',
+                      'X-Requested-With': 'XMLHttpRequest', 'X-XSRF-TOKEN': m ? decodeURIComponent(m[1]) : ''},
+            body: JSON.stringify(body)
+        });
+        if (hook) hook.shared = p;
+        p.then(function(r) { return r.clone().text().then(function(t) {
+            entry.status = r.status;
+            try { entry.json = JSON.parse(t); } catch (e) { entry.text = String(t).slice(0, 500); }
+            entry.done = true;
+            finish(entry);
+        }); }).catch(function(e) { entry.status = 0; entry.text = String(e); entry.done = true; finish(entry); });
+    };
+
+    // 不可枚举，避免出现在页面脚本遍历 window 的结果里
+    Object.defineProperty(window, '__wh', {value: wh, configurable: true, writable: true, enumerable: false});
+    return 'installed';
+})();
+""".replace("__WH_VERSION__", str(WH_VERSION))
+
+WH_CALL_JS = ("var h = window.__wh; return h && h.version === arguments[2] ? "
+              "{ok: true, value: h[arguments[0]].apply(h, arguments[1])} : {ok: false};")
+
+
+def install_wh_helpers(sb):
+    # 注册到当前标签页的 CDP 会话后，该标签页之后的每个新文档都会自动带上；
+    # uc_open_with_reconnect 新开的标签页、驱动重连后的会话都没有注册，调用时发现缺失再补注入并重新注册
+    try:
+        sb.driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": WH_HELPERS_JS})
+    except Exception:
+        pass
+    return sb.execute_script(WH_HELPERS_JS)
+
+
+def wh(sb, name, *args):
+    for _ in range(2):
+        res = sb.execute_script(WH_CALL_JS, name, list(args), WH_VERSION)
+        if isinstance(res, dict) and res.get("ok"):
+            return res.get("value")
+        install_wh_helpers(sb)
+    raise RuntimeError(f"页面辅助函数 __wh.{name} 不可用")
+
+
+# ============================================================
+#  Turnstile 处理（登录阶段）
+# ============================================================
+
+def ts_exists(sb):
+    try:
+        return wh(sb, "tsExists")
+    except:
+        return False
+
+
+def ts_solved(sb):
+    try:
+        return wh(sb, "tokenState") == "solved"
+    except:
+        return False
+
+
+def expand_turnstile(sb):
+    try:
+        wh(sb, "expandTurnstile")
+    except:
+        pass
+
+
+def focus_turnstile_area(sb):
+    try:
+        wh(sb, "focusTurnstile")
+        time.sleep(0.5)
+    except:
+        pass
+
+
+def handle_turnstile(sb, timeout=120):
+    if not ts_exists(sb):
+        return True
+    print("[INFO]   检测到 Turnstile，尝试自动解决...")
+    try:
+        if _input_mode == "cdp":
+            expand_turnstile(sb)
+            click_turnstile_checkbox(sb)
+            time.sleep(2)
+        else:
+            sb.uc_gui_handle_captcha()
+        if ts_solved(sb) or not ts_exists(sb):
+            print("[INFO]   自动解决成功 ✅")
+            return True
+    except:
+        pass
+
+    print("[INFO]   自动解决未完成，进入手动处理 ...")
+    start = time.time()
+    last_action = 0
+    while time.time() - start < timeout:
+        if ts_solved(sb):
+            print("[INFO]   Turnstile 令牌已生成 ✅")
             return True
         if not ts_exists(sb):
             print("[INFO]   Turnstile 元素消失，可能已通过")
@@ -486,7 +2055,10 @@ def handle_turnstile(sb, timeout=120):
                 except:
                     pass
 
-            if not clicked:
+            if not clicked and _input_mode == "cdp":
+                if click_turnstile_checkbox(sb):
+                    print("[INFO]   已通过 CDP 点击 Turnstile（备用）")
+            elif not clicked:
                 try:
                     sb.uc_gui_click_captcha()
                     print("[INFO]   已调用 uc_gui_click_captcha（备用）")
@@ -506,85 +2078,25 @@ def handle_turnstile(sb, timeout=120):
 
 def check_turnstile_exists_popup(sb):
     try:
-        return sb.execute_script(
-            "return document.querySelector('input[name=\"cf-turnstile-response\"]') !== null;"
-        )
+        return wh(sb, "tokenState") != "idle"
     except:
         return False
 
 def check_turnstile_solved_popup(sb):
     try:
-        return sb.execute_script("""
-            var input = document.querySelector('input[name="cf-turnstile-response"]');
-            return input && input.value && input.value.length > 20;
-        """)
+        return wh(sb, "tokenState") == "solved"
     except:
         return False
 
-EXPAND_POPUP_JS = """
-(function() {
-    var turnstileInput = document.querySelector('input[name="cf-turnstile-response"]');
-    if (!turnstileInput) return 'no turnstile input';
-    var el = turnstileInput;
-    for (var i = 0; i < 20; i++) {
-        el = el.parentElement;
-        if (!el) break;
-        var style = window.getComputedStyle(el);
-        if (style.overflow === 'hidden' || style.overflowX === 'hidden' || style.overflowY === 'hidden') {
-            el.style.overflow = 'visible';
-        }
-        el.style.minWidth = 'max-content';
-    }
-    var turnstileContainers = document.querySelectorAll('[class*="sc-fKFyDc"], [class*="nwOmR"]');
-    turnstileContainers.forEach(function(container) {
-        container.style.overflow = 'visible';
-        container.style.width = '300px';
-        container.style.minWidth = '300px';
-        container.style.height = '65px';
-    });
-    var iframes = document.querySelectorAll('iframe');
-    iframes.forEach(function(iframe) {
-        if (iframe.src && iframe.src.includes('challenges.cloudflare.com')) {
-            iframe.style.width = '300px';
-            iframe.style.height = '65px';
-            iframe.style.minWidth = '300px';
-            iframe.style.visibility = 'visible';
-            iframe.style.opacity = '1';
-        }
-    });
-    return 'done';
-})();
-"""
+def expand_popup(sb):
+    try:
+        return wh(sb, "expandPopup")
+    except:
+        return None
 
 def get_turnstile_checkbox_coords(sb):
     try:
-        return sb.execute_script("""
-            var iframes = document.querySelectorAll('iframe');
-            for (var i = 0; i < iframes.length; i++) {
-                var src = iframes[i].src || '';
-                if (src.includes('cloudflare') || src.includes('turnstile')) {
-                    var rect = iframes[i].getBoundingClientRect();
-                    if (rect.width > 0 && rect.height > 0) {
-                        return {x:rect.x, y:rect.y, width:rect.width, height:rect.height,
-                                click_x:Math.round(rect.x+30), click_y:Math.round(rect.y+rect.height/2)};
-                    }
-                }
-            }
-            var input = document.querySelector('input[name="cf-turnstile-response"]');
-            if (input) {
-                var container = input.parentElement;
-                for (var j = 0; j < 5; j++) {
-                    if (!container) break;
-                    var rect = container.getBoundingClientRect();
-                    if (rect.width > 100 && rect.height > 30) {
-                        return {x:rect.x, y:rect.y, width:rect.width, height:rect.height,
-                                click_x:Math.round(rect.x+30), click_y:Math.round(rect.y+rect.height/2)};
-                    }
-                    container = container.parentElement;
-                }
-            }
-            return null;
-        """)
+        return wh(sb, "checkboxCoords")
     except:
         return None
 
@@ -622,70 +2134,186 @@ def xdotool_click(x, y):
     except:
         return False
 
+# 持久的 X11 连接，通过 XTest 发送移动/点击，避免每次点击都启动 xdotool 进程
+X = xdisplay = xtest = None
+
+
+def load_xlib():
+    global X, xdisplay, xtest
+    if X is None:
+        try:
+            from Xlib import X as x_consts, display as x_display
+            from Xlib.ext import xtest as x_xtest
+        except ImportError:
+            return False
+        X, xdisplay, xtest = x_consts, x_display, x_xtest
+    return True
+
+
+class XTestInput:
+    def __init__(self, display_name=None):
+        self.display_name = display_name
+        self.display = xdisplay.Display(display_name)
+        if not self.display.has_extension("XTEST"):
+            self.display.close()
+            raise RuntimeError("X 服务器不支持 XTEST 扩展")
+        self.root = self.display.screen().root
+        self._window = None
+
+    def _find_chrome_window(self, window, depth=0):
+        try:
+            children = window.query_tree().children
+        except Exception:
+            return None
+        for child in children:
+            try:
+                wm_class = child.get_wm_class() or ()
+                viewable = child.get_attributes().map_state == X.IsViewable
+            except Exception:
+                continue
+            if viewable and any("chrom" in c.lower() for c in wm_class):
+                return child
+            if depth < 2:
+                found = self._find_chrome_window(child, depth + 1)
+                if found is not None:
+                    return found
+        return None
+
+    def chrome_window(self):
+        if self._window is not None:
+            try:
+                if self._window.get_attributes().map_state == X.IsViewable:
+                    return self._window
+            except Exception:
+                pass
+        self._window = self._find_chrome_window(self.root)
+        return self._window
+
+    def activate(self):
+        window = self.chrome_window()
+        if window is None:
+            return False
+        window.raise_window()
+        window.set_input_focus(X.RevertToParent, X.CurrentTime)
+        self.display.sync()
+        return True
+
+    def click(self, x, y, button=1):
+        self.activate()
+        xtest.fake_input(self.display, X.MotionNotify, x=int(x), y=int(y))
+        self.display.sync()
+        time.sleep(0.05)
+        xtest.fake_input(self.display, X.ButtonPress, button)
+        self.display.sync()
+        time.sleep(0.03)
+        xtest.fake_input(self.display, X.ButtonRelease, button)
+        self.display.sync()
+        return True
+
+    def close(self):
+        try:
+            self.display.close()
+        except Exception:
+            pass
+
+
+_xtest_input = None
+_xtest_failed = False
+
+
+def get_xtest_input():
+    global _xtest_input, _xtest_failed
+    if _xtest_failed or not load_xlib():
+        return None
+    display_name = os.environ.get("DISPLAY")
+    if _xtest_input is not None and _xtest_input.display_name != display_name:
+        _xtest_input.close()
+        _xtest_input = None
+    if _xtest_input is None:
+        try:
+            _xtest_input = XTestInput(display_name)
+        except Exception as e:
+            print(f"[WARN] XTest 初始化失败，改用 xdotool: {e}")
+            _xtest_failed = True
+            return None
+    return _xtest_input
+
+
+def screen_click(x, y, mode="xtest"):
+    global _xtest_input
+    backend = get_xtest_input() if mode == "xtest" else None
+    if backend is not None:
+        try:
+            return backend.click(x, y)
+        except Exception as e:
+            print(f"[WARN] XTest 点击失败，改用 xdotool: {e}")
+            backend.close()
+            _xtest_input = None
+    return xdotool_click(x, y)
+
+
+# Chrome DevTools 协议直接派发受信任的鼠标事件，坐标为视口坐标，不依赖 X11
+def cdp_click(sb, x, y):
+    x, y = int(x), int(y)
+    sb.driver.execute_cdp_cmd("Input.dispatchMouseEvent", {"type": "mouseMoved", "x": x, "y": y})
+    time.sleep(0.05)
+    for event in ("mousePressed", "mouseReleased"):
+        sb.driver.execute_cdp_cmd("Input.dispatchMouseEvent", {
+            "type": event, "x": x, "y": y, "button": "left", "buttons": 1, "clickCount": 1,
+        })
+    return True
+
+
+INPUT_MODES = ("auto", "xtest", "xdotool", "cdp")
+_input_mode = "xtest"
+
+
+def headless_enabled():
+    return os.environ.get("WEIRDHOST_HEADLESS", "").strip() == "1"
+
+
+def configure_input(headless=False):
+    global _input_mode
+    mode = os.environ.get("WEIRDHOST_INPUT", "auto").strip().lower() or "auto"
+    if mode not in INPUT_MODES:
+        print(f"[WARN] WEIRDHOST_INPUT={mode} 无效，使用 auto")
+        mode = "auto"
+    if mode == "auto":
+        mode = "cdp" if headless else "xtest"
+    elif headless and mode != "cdp":
+        print(f"[WARN] 无头模式没有 X11 显示，输入方式 {mode} 改为 cdp")
+        mode = "cdp"
+    _input_mode = mode
+    return mode
+
+
 def click_turnstile_checkbox(sb):
     coords = get_turnstile_checkbox_coords(sb)
     if not coords:
         print("[WARN] 无法获取 Turnstile 坐标")
         return False
+    if _input_mode == "cdp":
+        try:
+            return cdp_click(sb, coords["click_x"], coords["click_y"])
+        except Exception as e:
+            print(f"[ERROR] CDP 点击失败: {e}")
+            return False
     try:
-        window_info = sb.execute_script("""
-            return {screenX:window.screenX||0, screenY:window.screenY||0,
-                    outerHeight:window.outerHeight, innerHeight:window.innerHeight};
-        """)
+        window_info = wh(sb, "windowInfo")
         chrome_bar_height = window_info["outerHeight"] - window_info["innerHeight"]
         abs_x = coords["click_x"] + window_info["screenX"]
         abs_y = coords["click_y"] + window_info["screenY"] + chrome_bar_height
-        return xdotool_click(abs_x, abs_y)
+        return screen_click(abs_x, abs_y, _input_mode)
     except Exception as e:
         print(f"[ERROR] 坐标计算失败: {e}")
         return False
 
 def check_result_popup(sb):
     try:
-        return sb.execute_script("""
-            var buttons = document.querySelectorAll('button');
-            var hasNextBtn = false;
-            for (var i = 0; i < buttons.length; i++) {
-                if (buttons[i].innerText.includes('NEXT') || buttons[i].innerText.includes('Next')) {
-                    hasNextBtn = true; break;
-                }
-            }
-            var bodyText = document.body.innerText || '';
-            var hasSuccessTitle = bodyText.includes('Success');
-            var hasSuccessContent = bodyText.includes('성공') || bodyText.includes('갱신') || bodyText.includes('연장');
-            var hasCooldown = bodyText.includes('아직') || bodyText.includes('Error');
-            if (hasNextBtn || hasSuccessTitle) {
-                if (hasCooldown && bodyText.includes('아직')) return 'cooldown';
-                if (hasSuccessTitle && hasSuccessContent) return 'success';
-                if (hasNextBtn) {
-                    if (hasCooldown) return 'cooldown';
-                    if (hasSuccessContent) return 'success';
-                }
-            }
-            return null;
-        """)
+        return wh(sb, "classifyResult")
     except:
         return None
 
-def check_popup_still_open(sb):
-    try:
-        return sb.execute_script("""
-            var t = document.querySelector('input[name="cf-turnstile-response"]');
-            if (!t) return false;
-            var buttons = document.querySelectorAll('button');
-            for (var i = 0; i < buttons.length; i++) {
-                var text = buttons[i].innerText || '';
-                if ((text.includes('시간추가') || text.includes('시간 추가') || text.includes('연장하기'))
-                    && !text.includes('DELETE')) {
-                    var rect = buttons[i].getBoundingClientRect();
-                    if (rect.x > 200 && rect.width > 0) return true;
-                }
-            }
-            return false;
-        """)
-    except:
-        return False
-
 def click_next_button(sb):
     try:
         for sel in [
@@ -701,95 +2329,247 @@ def click_next_button(sb):
         pass
     return False
 
-def handle_renewal_popup(sb, screenshot_prefix="", timeout=90):
-    screenshot_name = f"{screenshot_prefix}_popup.png" if screenshot_prefix else "popup_fixed.png"
+WAIT_POPUP_STATE_JS = """
+var done = arguments[arguments.length - 1];
+if (!window.__wh) { done({missing: true}); return; }
+window.__wh.waitState(arguments[0], arguments[1], done);
+"""
 
-    print("[INFO]   [阶段1] 等待弹窗和 Turnstile...")
+RESULT_STATES = ("success", "cooldown")
+
+RENEW_SUBMIT_JS = """
+var done = arguments[arguments.length - 1];
+if (!window.__wh) { done({status: 0, text: 'no helpers'}); return; }
+window.__wh.submitRenewal(arguments[0], arguments[1], arguments[2], arguments[3], done);
+"""
+
+RENEW_MODES = ("click", "api")
+
+
+def renew_mode():
+    mode = os.environ.get("WEIRDHOST_RENEW_MODE", "click").strip().lower() or "click"
+    if mode not in RENEW_MODES:
+        print(f"[WARN] WEIRDHOST_RENEW_MODE={mode} 无效，使用 click")
+        return "click"
+    return mode
+
+
+def install_popup_watcher(sb):
+    try:
+        return wh(sb, "watchPopup")
+    except:
+        return None
+
+
+def poll_popup_state(sb):
+    result = check_result_popup(sb)
+    if result:
+        return result
+    if check_turnstile_solved_popup(sb):
+        return "solved"
+    if check_turnstile_exists_popup(sb):
+        return "turnstile"
+    return "idle"
+
+
+def wait_popup_state(sb, states, timeout):
+    for _ in range(2):
+        try:
+            snap = sb.driver.execute_async_script(WAIT_POPUP_STATE_JS, list(states), int(timeout * 1000))
+        except:
+            snap = None
+        if isinstance(snap, dict) and snap.get("missing"):
+            install_popup_watcher(sb)
+            continue
+        break
+    if not isinstance(snap, dict) or "state" not in snap:
+        state = poll_popup_state(sb)
+        if state not in states:
+            time.sleep(min(timeout, 1))
+        snap = {"state": state, "history": [], "timeout": state not in states}
+    return snap
+
+
+def result_from_history(snap):
+    for entry in reversed(snap.get("history") or []):
+        if entry.get("state") in RESULT_STATES:
+            return entry["state"]
+    return None
+
+
+# ============================================================
+#  续期接口直接提交（学习弹窗调用的接口，之后用令牌直接请求）
+# ============================================================
+
+_renew_endpoint = None
+
+
+def get_renew_endpoint():
+    global _renew_endpoint
+    if _renew_endpoint is None:
+        _renew_endpoint = load_run_state().get("renew_endpoint") or {}
+    return _renew_endpoint or None
 
-    turnstile_ready = False
-    for _ in range(20):
-        result = check_result_popup(sb)
-        if result == "cooldown":
-            print("[INFO]   检测到冷却期弹窗")
-            sb.save_screenshot(screenshot_name)
-            return {"status": "cooldown", "screenshot": screenshot_name}
-        if result == "success":
-            print("[INFO]   检测到成功弹窗")
-            sb.save_screenshot(screenshot_name)
-            return {"status": "success", "screenshot": screenshot_name}
-        if check_turnstile_exists_popup(sb):
-            turnstile_ready = True
-            print("[INFO]   检测到 Turnstile")
-            break
-        time.sleep(1)
 
-    if not turnstile_ready:
+def learn_renew_endpoint(call, server):
+    global _renew_endpoint
+    server_uuid = (server or {}).get("uuid")
+    url = call.get("url") or ""
+    if not server_uuid or server_uuid not in url or not call.get("json"):
+        return None
+    parsed = urlparse(url)
+    path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+    path = re.sub(r"/(?:not)?freeservers/", "/{kind}/", path.replace(server_uuid, "{uuid}"), count=1)
+    body_key = "cf-turnstile-response"
+    try:
+        body = json.loads(call.get("body") or "{}")
+        for k, v in body.items():
+            if isinstance(v, str) and len(v) > 20:
+                body_key = k
+                break
+    except Exception:
+        pass
+    endpoint = {"path": path, "method": call.get("method") or "POST", "body_key": body_key}
+    current = get_renew_endpoint() or {}
+    if all(current.get(k) == v for k, v in endpoint.items()):
+        return current
+    endpoint["learned_at"] = time.time()
+    _renew_endpoint = endpoint
+    state = load_run_state()
+    state["renew_endpoint"] = endpoint
+    save_run_state(state)
+    print(f"[INFO]   已记录续期接口: {endpoint['method']} {path}")
+    return endpoint
+
+
+def renew_result_from_call(call):
+    status = int(call.get("status") or 0)
+    data = call.get("json") if isinstance(call.get("json"), dict) else {}
+    message = str(data.get("message") or data.get("error") or call.get("text") or "")
+    payload = data.get("data") if isinstance(data.get("data"), dict) else data
+    if 200 <= status < 300 and data and data.get("success", True) is not False:
+        return {"status": "success", "new_expiry": payload.get("expire"), "message": message}
+    if "아직" in message or status == 429:
+        return {"status": "cooldown", "message": message}
+    return {"status": "error", "message": f"续期接口返回 {status}: {message[:80]}"}
+
+
+def submit_renewal_api(sb, server, timeout=20):
+    endpoint = get_renew_endpoint()
+    if not endpoint or not (server or {}).get("uuid"):
+        return None
+    kind = "freeservers" if server.get("server_type") == "free" else "notfreeservers"
+    path = endpoint["path"].replace("{kind}", kind).replace("{uuid}", server["uuid"])
+    try:
+        call = sb.driver.execute_async_script(
+            RENEW_SUBMIT_JS, path, endpoint["method"], endpoint["body_key"], int(timeout * 1000)
+        )
+    except Exception as e:
+        print(f"[WARN]   续期接口提交失败: {e}")
+        return None
+    if not isinstance(call, dict) or not call.get("done"):
+        print(f"[WARN]   续期接口无响应: {(call or {}).get('text', '')}")
+        return None
+    return call
+
+
+def popup_api_result(sb, call, server, screenshot_name):
+    learn_renew_endpoint(call, server)
+    result = renew_result_from_call(call)
+    result.update(api=True, screenshot=screenshot_name)
+    if result["status"] == "success":
+        print(f"[INFO]   续期成功! 新到期时间: {result.get('new_expiry') or 'Unknown'}")
+    elif result["status"] == "cooldown":
+        print("[INFO]   冷却期内")
+    else:
+        print(f"[WARN]   {result['message']}")
+    take_screenshot(sb, screenshot_name)
+    click_next_button(sb)
+    return result
+
+
+def handle_renewal_popup(sb, screenshot_prefix="", timeout=90, server=None):
+    screenshot_name = f"{screenshot_prefix}_popup.png" if screenshot_prefix else "popup_fixed.png"
+    mode = renew_mode()
+
+    print("[INFO]   [阶段1] 等待弹窗和 Turnstile...")
+    install_popup_watcher(sb)
+
+    snap = wait_popup_state(sb, RESULT_STATES + ("turnstile", "solved", "api"), 20)
+    if snap.get("renew"):
+        return popup_api_result(sb, snap["renew"], server, screenshot_name)
+    if snap["state"] == "cooldown":
+        print("[INFO]   检测到冷却期弹窗")
+        take_screenshot(sb, screenshot_name)
+        return {"status": "cooldown", "screenshot": screenshot_name}
+    if snap["state"] == "success":
+        print("[INFO]   检测到成功弹窗")
+        take_screenshot(sb, screenshot_name)
+        return {"status": "success", "screenshot": screenshot_name}
+    if snap["state"] not in ("turnstile", "solved"):
         print("[WARN]   未检测到 Turnstile")
-        sb.save_screenshot(screenshot_name)
+        take_screenshot(sb, screenshot_name)
         return {"status": "error", "message": "未检测到 Turnstile", "screenshot": screenshot_name}
+    print("[INFO]   检测到 Turnstile")
 
     print("[INFO]   [阶段2] 修复弹窗样式...")
     for _ in range(3):
-        sb.execute_script(EXPAND_POPUP_JS)
+        expand_popup(sb)
         time.sleep(0.5)
-    sb.save_screenshot(screenshot_name)
+    take_screenshot(sb, screenshot_name)
 
     print("[INFO]   [阶段3] 点击 Turnstile...")
     for attempt in range(6):
-        if check_turnstile_solved_popup(sb):
+        if snap["state"] != "turnstile":
             print("[INFO]   Turnstile 已通过!")
             break
-        sb.execute_script(EXPAND_POPUP_JS)
+        expand_popup(sb)
         time.sleep(0.3)
         click_turnstile_checkbox(sb)
-        for _ in range(8):
-            time.sleep(0.5)
-            if check_turnstile_solved_popup(sb):
-                print("[INFO]   Turnstile 已通过!")
-                break
-        if check_turnstile_solved_popup(sb):
+        snap = wait_popup_state(sb, RESULT_STATES + ("solved", "api"), 4)
+        if snap["state"] != "turnstile":
+            print("[INFO]   Turnstile 已通过!")
             break
-        sb.save_screenshot(
+        take_screenshot(
+            sb,
             f"{screenshot_prefix}_turnstile_{attempt}.png" if screenshot_prefix
             else f"turnstile_attempt_{attempt}.png"
         )
 
+    if mode == "api" and not snap.get("renew") and snap["state"] == "solved":
+        print("[INFO]   [阶段4] 直接提交续期接口...")
+        call = submit_renewal_api(sb, server)
+        if call:
+            return popup_api_result(sb, call, server, screenshot_name)
+        print("[INFO]   续期接口未知或提交失败，等待弹窗自己提交")
+
     print("[INFO]   等待提交结果...")
     result_start = time.time()
-    last_screenshot_time = 0
 
-    while time.time() - result_start < 45:
-        result = check_result_popup(sb)
+    while True:
+        if snap.get("renew"):
+            return popup_api_result(sb, snap["renew"], server, screenshot_name)
+        result = snap["state"] if snap["state"] in RESULT_STATES else result_from_history(snap)
         if result == "success":
             print("[INFO]   续期成功!")
-            sb.save_screenshot(screenshot_name)
+            take_screenshot(sb, screenshot_name)
             time.sleep(1)
             click_next_button(sb)
             return {"status": "success", "screenshot": screenshot_name}
         if result == "cooldown":
             print("[INFO]   冷却期内")
-            sb.save_screenshot(screenshot_name)
+            take_screenshot(sb, screenshot_name)
             time.sleep(1)
             click_next_button(sb)
             return {"status": "cooldown", "screenshot": screenshot_name}
-        if not check_popup_still_open(sb):
-            time.sleep(2)
-            result = check_result_popup(sb)
-            if result:
-                sb.save_screenshot(screenshot_name)
-                if result == "success":
-                    click_next_button(sb)
-                    return {"status": "success", "screenshot": screenshot_name}
-                elif result == "cooldown":
-                    click_next_button(sb)
-                    return {"status": "cooldown", "screenshot": screenshot_name}
-        if time.time() - last_screenshot_time > 5:
-            sb.save_screenshot(screenshot_name)
-            last_screenshot_time = time.time()
-        time.sleep(1)
+        remaining = 45 - (time.time() - result_start)
+        if remaining <= 0:
+            break
+        take_screenshot(sb, screenshot_name)
+        snap = wait_popup_state(sb, RESULT_STATES + ("api",), min(5, remaining))
 
     print("[WARN]   等待结果超时")
-    sb.save_screenshot(screenshot_name)
+    take_screenshot(sb, screenshot_name)
     return {"status": "timeout", "screenshot": screenshot_name}
 
 
@@ -797,68 +2577,120 @@ def handle_renewal_popup(sb, screenshot_prefix="", timeout=90):
 #  SeleniumBase 页面交互（通用）
 # ============================================================
 
-def get_expiry_from_page(sb):
+def probe_page_state(sb):
     try:
-        page_text = sb.get_page_source()
-        match = re.search(r'유통기한\s*(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})', page_text)
-        if match:
-            return match.group(1).strip()
-        match = re.search(r'(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})', page_text)
-        if match:
-            return match.group(1).strip()
-        return "Unknown"
+        return wh(sb, "probe", RENEWAL_BUTTON_SELECTORS)
     except:
-        return "Unknown"
+        return None
 
 
-def find_renewal_button(sb):
-    for selector in RENEWAL_BUTTON_SELECTORS:
-        try:
-            if sb.is_element_present(selector):
-                return selector
-        except:
-            continue
-    return None
+def get_expiry_from_page(sb, probe=None):
+    probe = probe or probe_page_state(sb)
+    if not probe:
+        return "Unknown"
+    return probe.get("expiry") or "Unknown"
 
 
-def check_renewal_button_enabled(sb):
-    xpath = find_renewal_button(sb)
-    if not xpath:
-        return (False, False, None, "页面上未找到续期按钮")
+def find_renewal_button(sb, probe=None):
+    probe = probe or probe_page_state(sb)
+    if not probe or probe.get("button_index", -1) < 0:
+        return None
+    return RENEWAL_BUTTON_SELECTORS[probe["button_index"]]
 
-    try:
-        is_disabled = sb.execute_script(f"""
-            var btn = document.evaluate("{xpath}", document, null,
-                XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
-            if (!btn) return null;
-            return btn.disabled || btn.getAttribute('aria-disabled') === 'true'
-                   || btn.classList.contains('disabled');
-        """)
-        if is_disabled is None:
-            return (False, False, None, "按钮元素无法访问")
-        if is_disabled:
-            return (True, False, xpath, "续期按钮已禁用（可能在冷却期）")
-    except:
-        pass
 
+def check_renewal_button_enabled(sb, probe=None):
+    probe = probe or probe_page_state(sb)
+    xpath = find_renewal_button(sb, probe)
+    if not xpath:
+        return (False, False, None, "页面上未找到续期按钮")
+    if probe.get("button_disabled"):
+        return (True, False, xpath, "续期按钮已禁用（可能在冷却期）")
     return (True, True, xpath, "")
 
 
-def is_logged_in(sb):
-    try:
-        url = sb.get_current_url()
-        if "/login" in url or "/auth" in url:
-            return False
-        if get_expiry_from_page(sb) != "Unknown":
-            return True
-        if find_renewal_button(sb):
-            return True
-        if sb.is_element_present("//div[contains(@class,'ServerControls')]") or \
-           sb.is_element_present("//a[contains(@href,'/server/')]"):
-            return True
+def is_logged_in(sb, probe=None):
+    probe = probe or probe_page_state(sb)
+    if not probe:
         return False
-    except:
+    url = probe.get("url", "")
+    if "/login" in url or "/auth" in url:
         return False
+    return (probe.get("expiry", "Unknown") != "Unknown"
+            or probe.get("button_index", -1) >= 0
+            or probe.get("server_controls", False)
+            or probe.get("server_link", False))
+
+
+# ============================================================
+#  页面就绪等待（按条件轮询，取代固定 sleep）
+# ============================================================
+
+READY_CONDITIONS = {
+    "expiry": lambda p: p.get("expiry", "Unknown") != "Unknown",
+    "button": lambda p: p.get("button_index", -1) >= 0,
+    "turnstile": lambda p: bool(p.get("turnstile")),
+    "logged_in": lambda p: is_logged_in(None, p),
+    "login_page": lambda p: ("/login" in p.get("url", "") or "/auth" in p.get("url", ""))
+                            and p.get("ready_state") == "complete",
+}
+SERVER_PAGE_READY = ("expiry", "button", "login_page")
+SITE_READY = ("logged_in", "turnstile", "login_page")
+
+
+def wait_for_page_ready(sb, conditions, timeout=10, interval=0.25):
+    deadline = time.time() + timeout
+    probe = None
+    while True:
+        probe = probe_page_state(sb)
+        if probe:
+            for name in conditions:
+                if READY_CONDITIONS[name](probe):
+                    return name, probe
+        if time.time() >= deadline:
+            return None, probe
+        time.sleep(interval)
+
+
+class ReconnectPolicy:
+    # 未见过 CF 挑战时用短重连时间；一旦遇到挑战，本进程后续导航都用长重连时间
+    def __init__(self):
+        self.fast = env_float("WEIRDHOST_RECONNECT_FAST", 1.5)
+        self.slow = env_float("WEIRDHOST_RECONNECT_SLOW", 5)
+        self.challenge_seen = None
+
+    def reconnect_time(self):
+        return self.fast if self.challenge_seen is False else self.slow
+
+    def observe(self, challenged):
+        if challenged:
+            self.challenge_seen = True
+        elif self.challenge_seen is None:
+            self.challenge_seen = False
+
+
+RECONNECT = ReconnectPolicy()
+
+
+def navigate(sb, url, reconnect_time=None):
+    used = reconnect_time or RECONNECT.reconnect_time()
+    sb.uc_open_with_reconnect(url, reconnect_time=used)
+    if ACTIVE_CONTEXT is not None:
+        ACTIVE_CONTEXT.activate(sb)
+    probe = probe_page_state(sb) or {}
+    challenged = bool(probe.get("challenge"))
+    RECONNECT.observe(challenged)
+    if challenged and used < RECONNECT.slow:
+        print(f"  [INFO] 检测到 CF 挑战，改用 {RECONNECT.slow:g}s 重连时间重新打开")
+        sb.uc_open_with_reconnect(url, reconnect_time=RECONNECT.slow)
+        if ACTIVE_CONTEXT is not None:
+            ACTIVE_CONTEXT.activate(sb)
+
+
+def open_site(sb, url, timeout=10):
+    navigate(sb, url)
+    ready = wait_for_page_ready(sb, SITE_READY, timeout)
+    CAPTURE.drain(sb)
+    return ready
 
 
 def check_and_update_cookie(sb, cookie_env, original_cookie_value, remark=""):
@@ -874,25 +2706,120 @@ def check_and_update_cookie(sb, cookie_env, original_cookie_value, remark=""):
                         new_secret_value = f"{remark}-----{new_cookie_str}"
                     else:
                         new_secret_value = new_cookie_str
-                    print(f"[INFO]   Cookie 已变化，更新 {cookie_env}...")
-                    if asyncio.run(update_github_secret(cookie_env, new_secret_value)):
-                        print(f"[INFO]   ✅ {cookie_env} 已更新")
-                        return True
-                    else:
-                        print(f"[ERROR]  ❌ {cookie_env} 更新失败")
-                        return False
+                    # 只登记待写入；是否更新成功要等 flush_github_secrets() 之后才知道
+                    staged = stage_github_secret(cookie_env, new_secret_value)
+                    if staged:
+                        print(f"[INFO]   Cookie 已变化，{cookie_env} 将在运行结束时更新")
+                    return staged
                 break
     except Exception as e:
         print(f"[ERROR]  Cookie 检查失败: {e}")
     return False
 
 
+# ============================================================
+#  资源拦截（服务器页面只需要到期时间、续期按钮和 Turnstile）
+# ============================================================
+
+BLOCK_PROFILES = ("off", "light", "aggressive")
+# 所有规则都限定域名，不会匹配 challenges.cloudflare.com
+THIRD_PARTY_BLOCK_PATTERNS = (
+    "*://*.google-analytics.com/*", "*://*.googletagmanager.com/*",
+    "*://*.googlesyndication.com/*", "*://*.doubleclick.net/*",
+    "*://adservice.google.com/*", "*://fonts.googleapis.com/*", "*://fonts.gstatic.com/*",
+    "*://static.cloudflareinsights.com/*", "*://*.hotjar.com/*",
+)
+SITE_ASSET_EXTENSIONS = ("png", "jpg", "jpeg", "gif", "webp", "svg", "ico",
+                         "woff", "woff2", "ttf", "otf", "mp4", "webm")
+
+
+def block_profile():
+    profile = os.environ.get("WEIRDHOST_BLOCK_PROFILE", "off").strip().lower() or "off"
+    if profile not in BLOCK_PROFILES:
+        print(f"[WARN] WEIRDHOST_BLOCK_PROFILE={profile} 无效，使用 off")
+        return "off"
+    return profile
+
+
+def block_patterns(profile):
+    if profile == "off":
+        return []
+    patterns = list(THIRD_PARTY_BLOCK_PATTERNS)
+    if profile == "aggressive":
+        patterns += [f"*://{DOMAIN}/*.{ext}*" for ext in SITE_ASSET_EXTENSIONS]
+        # 服务器控制台的 wings websocket（/api/servers/<uuid>/ws）
+        patterns.append("wss://*/api/servers/*/ws*")
+    return patterns
+
+
+def page_metrics(sb):
+    try:
+        return wh(sb, "metrics") or {}
+    except Exception:
+        return {}
+
+
+def challenge_present(sb):
+    try:
+        text = wh(sb, "challengeText") or ""
+    except Exception:
+        return False
+    return any(m in text for m in CHALLENGE_MARKERS)
+
+
+_page_loads = 0
+_baseline_loads = 0
+
+
+def open_server_page(sb, url, timeout=12):
+    # 拦截规则只对当前标签页的 CDP 会话生效，而 uc_open_with_reconnect 每次都会新开标签页，
+    # 所以启用拦截时在当前标签页内导航；遇到 CF 挑战再回退到 uc_open_with_reconnect。
+    # 基线（off）与拦截页面用同一种导航方式，并与拦截页面交替采样，避免缓存冷热造成的偏差；
+    # 经 uc_open_with_reconnect 打开的页面单独记为 reconnect，不参与对比
+    global _page_loads, _baseline_loads
+    profile = block_profile()
+    if profile != "off":
+        _page_loads += 1
+        if _page_loads % 2 == 1 and _baseline_loads < env_float("WEIRDHOST_BLOCK_BASELINE", 3):
+            _baseline_loads += 1
+            profile = "off"
+    else:
+        profile = "reconnect"
+    t = time.perf_counter()
+    if profile == "reconnect":
+        navigate(sb, url)
+    else:
+        try:
+            sb.driver.execute_cdp_cmd("Network.enable", {})
+            sb.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": block_patterns(profile)})
+            sb.driver.get(url)
+        except Exception as e:
+            if is_browser_crash(e, sb):
+                raise
+            print(f"  [WARN] 拦截模式打开页面失败，回退: {e}")
+            profile = "reconnect"
+            navigate(sb, url)
+        else:
+            if challenge_present(sb):
+                print(f"  [WARN] 拦截模式遇到 CF 挑战，回退到 uc_open_with_reconnect")
+                RECONNECT.observe(True)
+                profile = "reconnect"
+                navigate(sb, url)
+    condition, probe = wait_for_page_ready(sb, SERVER_PAGE_READY, timeout)
+    if condition == "expiry" and not READY_CONDITIONS["button"](probe):
+        # 到期时间先渲染出来时，再给续期按钮一点时间
+        _, probe = wait_for_page_ready(sb, ("button",), 3)
+    RUN_TIMER.record_page_load(profile, page_metrics(sb), time.perf_counter() - t)
+    CAPTURE.drain(sb)
+    return probe
+
+
 # ============================================================
 #  单个服务器续期处理
 # ============================================================
 
 def process_single_server(sb, server_info, cookie_name, cookie_value, cookie_str,
-                          cookie_env, remark, screenshot_prefix):
+                          cookie_env, remark, screenshot_prefix, http=None):
     server_id = server_info.get("identifier", "Unknown")
     server_uuid = server_info.get("uuid", "")
     server_type = server_info.get("server_type", "notfree")
@@ -904,6 +2831,7 @@ def process_single_server(sb, server_info, cookie_name, cookie_value, cookie_str
         "server_uuid": server_uuid,
         "server_type": server_type,
         "server_name": server_name,
+        "add_hours": server_info.get("add_hours", "Unknown"),
         "status": "unknown",
         "original_expiry": api_expiry,
         "new_expiry": api_expiry,
@@ -920,72 +2848,81 @@ def process_single_server(sb, server_info, cookie_name, cookie_value, cookie_str
     print(f"  [INFO] 服务器: {mask_server_id(server_id)} [{server_type}] {server_name}")
     print(f"  [INFO] 到期: {api_expiry} | 剩余: {calculate_remaining_time(api_expiry)} ({dd}天)")
     print(f"  [INFO] 访问服务器页面...")
+    RUN_TIMER.enter("server page", server=screenshot_prefix)
 
     try:
-        sb.uc_open_with_reconnect(server_url, reconnect_time=5)
-        time.sleep(3)
+        probe = open_server_page(sb, server_url)
 
-        if not is_logged_in(sb):
+        if not is_logged_in(sb, probe):
             sb.add_cookie({"name": cookie_name, "value": cookie_value, "domain": DOMAIN, "path": "/"})
-            sb.uc_open_with_reconnect(server_url, reconnect_time=5)
-            time.sleep(3)
+            probe = open_server_page(sb, server_url)
 
-        if not is_logged_in(sb):
+        if not is_logged_in(sb, probe):
             ss_path = f"{screenshot_prefix}_login_fail.png"
-            sb.save_screenshot(ss_path)
+            take_screenshot(sb, ss_path)
             srv_result.update(status="error", message="浏览器登录失败", screenshot=ss_path)
             print(f"  [ERROR] 浏览器登录失败")
             return srv_result
 
         print(f"  [INFO] 登录成功")
 
-        page_expiry = get_expiry_from_page(sb)
+        page_expiry = get_expiry_from_page(sb, probe)
         if page_expiry != "Unknown":
             srv_result["original_expiry"] = page_expiry
 
         print(f"  [INFO] 检查续期按钮...")
-        btn_found, btn_enabled, btn_xpath, btn_reason = check_renewal_button_enabled(sb)
+        btn_found, btn_enabled, btn_xpath, btn_reason = check_renewal_button_enabled(sb, probe)
 
         if not btn_found:
             print(f"  [WARN] {btn_reason}")
             ss_path = f"{screenshot_prefix}_no_btn.png"
-            sb.save_screenshot(ss_path)
+            take_screenshot(sb, ss_path)
             srv_result.update(status="skipped", message=btn_reason, screenshot=ss_path)
             return srv_result
 
         if not btn_enabled:
             print(f"  [WARN] {btn_reason}")
             ss_path = f"{screenshot_prefix}_btn_disabled.png"
-            sb.save_screenshot(ss_path)
+            take_screenshot(sb, ss_path)
             srv_result.update(status="skipped", message=btn_reason, screenshot=ss_path)
             return srv_result
 
         print(f"  [INFO] 续期按钮可用，执行续期")
 
+        RUN_TIMER.enter("renewal popup")
+        install_popup_watcher(sb)
         random_delay(1.0, 2.0)
         sb.click(btn_xpath)
         print(f"  [INFO] 已点击续期按钮，等待弹窗...")
-        time.sleep(3)
 
-        popup_result = handle_renewal_popup(sb, screenshot_prefix=screenshot_prefix, timeout=90)
+        popup_result = handle_renewal_popup(sb, screenshot_prefix=screenshot_prefix, timeout=90,
+                                            server=server_info)
         srv_result["screenshot"] = popup_result.get("screenshot")
 
-        # 验证到期时间
-        time.sleep(3)
+        # 验证到期时间（续期接口的 JSON 已带新到期时间时不再请求）
+        RUN_TIMER.enter("verify")
         xsrf_token = get_xsrf_token_from_cookies(sb)
         if server_uuid:
-            ep = f"/freeservers/{server_uuid}/info" if server_type == "free" else f"/notfreeservers/{server_uuid}/info"
-            new_info = api_fetch_json(sb, f"{API_BASE_URL}{ep}", xsrf_token)
-            if new_info and new_info.get("success"):
+            CAPTURE.invalidate(sb, server_info_url(server_uuid, server_type))
+        new_expiry = popup_result.get("new_expiry")
+        if new_expiry is None and popup_result.get("api") and popup_result["status"] != "success":
+            new_expiry = srv_result["original_expiry"]
+        if new_expiry is None and server_uuid:
+            # 续期成功后后端写入新到期时间可能有延迟，短间隔轮询直到变化或超时
+            original_dt = parse_expiry_to_datetime(srv_result["original_expiry"])
+            deadline = time.time() + (6 if popup_result["status"] == "success" else 0)
+            while True:
+                new_info = api_get_json(sb, server_info_url(server_uuid, server_type), xsrf_token, http)
+                if not (new_info and new_info.get("success")):
+                    new_expiry = None
+                    break
                 new_expiry = new_info.get("data", {}).get("expire", srv_result["original_expiry"])
-            else:
-                sb.uc_open_with_reconnect(server_url, reconnect_time=3)
-                time.sleep(3)
-                new_expiry = get_expiry_from_page(sb)
-        else:
-            sb.uc_open_with_reconnect(server_url, reconnect_time=3)
-            time.sleep(3)
-            new_expiry = get_expiry_from_page(sb)
+                new_dt = parse_expiry_to_datetime(new_expiry)
+                if not original_dt or (new_dt and new_dt > original_dt) or time.time() >= deadline:
+                    break
+                time.sleep(0.75)
+        if new_expiry is None:
+            new_expiry = get_expiry_from_page(sb, open_server_page(sb, server_url))
 
         srv_result["new_expiry"] = new_expiry
 
@@ -1007,21 +2944,23 @@ def process_single_server(sb, server_info, cookie_name, cookie_value, cookie_str
             print(f"  [WARN] 结果: {popup_result['status']}")
 
         if check_and_update_cookie(sb, cookie_env, cookie_value, remark):
-            srv_result["cookie_updated"] = True
+            srv_result["cookie_staged"] = True
 
-        if not srv_result["screenshot"] or not os.path.exists(srv_result["screenshot"]):
+        if not SCREENSHOTS.has(srv_result["screenshot"]):
             final_ss = f"{screenshot_prefix}_final.png"
-            sb.save_screenshot(final_ss)
+            take_screenshot(sb, final_ss)
             srv_result["screenshot"] = final_ss
 
     except Exception as e:
+        if is_browser_crash(e, sb):
+            raise BrowserCrashed(repr(e)) from e
         import traceback
         print(f"  [ERROR] 异常: {repr(e)}")
         traceback.print_exc()
         srv_result.update(status="error", message=str(e)[:100])
         try:
             ss_path = f"{screenshot_prefix}_error.png"
-            sb.save_screenshot(ss_path)
+            take_screenshot(sb, ss_path)
             srv_result["screenshot"] = ss_path
         except:
             pass
@@ -1033,7 +2972,7 @@ def process_single_server(sb, server_info, cookie_name, cookie_value, cookie_str
 #  单个账号处理
 # ============================================================
 
-def process_single_account(sb, account, account_index):
+def process_single_account(sb, account, account_index, renew=True, context=None):
     remark = account.get("remark", f"账号{account_index + 1}")
     cookie_env = account.get("cookie_env", "")
     cookie_str = account.get("cookie_str", "")
@@ -1054,30 +2993,52 @@ def process_single_account(sb, account, account_index):
     print(f"[INFO] 处理账号 [{account_index + 1}]: {mask_remark(remark)} ({cookie_env})")
     print(f"{'=' * 60}")
 
+    # Step 0: 恢复会话缓存（首次导航前）
+    RUN_TIMER.instrument(sb)
+    CAPTURE.reset(sb)
+    RUN_TIMER.enter("login turnstile", account=f"acc{account_index + 1}")
+    cached_session = load_session_state(account)
+    restored = restore_browser_session(sb, cached_session)
+    if restored:
+        print(f"[INFO] [步骤0] 已恢复会话缓存（{(time.time() - cached_session['saved_at']) / 3600:.1f} 小时前）")
+
     # Step 1: Turnstile (登录阶段)
     print(f"[INFO] [步骤1] 访问站点并处理 Cloudflare 验证...")
-    sb.uc_open_with_reconnect(f"https://{DOMAIN}/", reconnect_time=5)
-    if not handle_turnstile(sb):
-        print(f"[ERROR] Turnstile 验证失败")
-        result["status"] = "error"
-        result["message"] = "Cloudflare Turnstile 验证失败"
-        return result
-    print(f"[INFO] ✅ CF 验证通过")
-
-    # Step 2: 注入 Cookie 并登录
-    print(f"[INFO] [步骤2] 注入 Cookie 并登录...")
-    sb.add_cookie({"name": cookie_name, "value": cookie_value, "domain": DOMAIN, "path": "/"})
-    sb.uc_open_with_reconnect(f"https://{DOMAIN}/", reconnect_time=5)
-    time.sleep(3)
+    condition = None
+    if restored and context is not None and context.preloaded:
+        condition, _ = wait_for_page_ready(sb, SITE_READY, 3)
+        if condition == "logged_in":
+            print(f"[INFO]   后台预加载的页面已登录")
+            CAPTURE.drain(sb)
+    if condition != "logged_in":
+        condition, _ = open_site(sb, f"{SITE_URL}/", timeout=8)
+    cache_hit = restored and condition == "logged_in"
+    if cache_hit:
+        print(f"[INFO] ✅ 缓存会话有效，跳过 Turnstile 和 Cookie 注入")
+    else:
+        if restored:
+            print(f"[INFO]   缓存会话被拒绝，重新验证")
+            drop_session_state(account)
+        if not handle_turnstile(sb):
+            print(f"[ERROR] Turnstile 验证失败")
+            result["status"] = "error"
+            result["message"] = "Cloudflare Turnstile 验证失败"
+            return result
+        print(f"[INFO] ✅ CF 验证通过")
+
+        # Step 2: 注入 Cookie 并登录
+        print(f"[INFO] [步骤2] 注入 Cookie 并登录...")
+        sb.add_cookie({"name": cookie_name, "value": cookie_value, "domain": DOMAIN, "path": "/"})
+        open_site(sb, f"{SITE_URL}/")
 
     if not is_logged_in(sb):
         print("[WARN]   未检测到登录状态，尝试刷新...")
-        sb.uc_open_with_reconnect(f"https://{DOMAIN}/server/", reconnect_time=5)
-        time.sleep(3)
+        open_site(sb, f"{SITE_URL}/server/")
 
     if not is_logged_in(sb):
         ss_path = f"acc{account_index+1}_login_fail.png"
-        sb.save_screenshot(ss_path)
+        take_screenshot(sb, ss_path)
+        result["screenshot"] = ss_path
         result["status"] = "cookie_invalid"
         result["message"] = "Cookie 失效或登录失败（Turnstile 通过后仍无法登录）"
         return result
@@ -1085,81 +3046,361 @@ def process_single_account(sb, account, account_index):
     xsrf_token = get_xsrf_token_from_cookies(sb)
     print(f"[INFO]   登录成功，已获取会话 Cookie")
 
-    # Step 3: 获取信息
-    print(f"[INFO] [步骤3] 获取账号信息...")
-    server_data = api_fetch_json(sb, f"{API_BASE_URL}?page=1", xsrf_token)
-    if not server_data or server_data.get("error") == "unauthorized":
-        print(f"[ERROR]   获取服务器列表失败")
-        result["status"] = "error"
-        result["message"] = "无法获取服务器列表"
-        return result
+    session_state = capture_browser_session(sb)
+    save_session_state(account, session_state)
+    http = open_http_client(session_state, account)
+    try:
+        return process_account_servers(sb, account, account_index, result, xsrf_token, http, renew)
+    finally:
+        if http:
+            http.close()
+        save_session_state(account, capture_browser_session(sb))
+
+
+def server_list_url(page):
+    return f"{API_BASE_URL}?page={page}"
+
 
-    email_data = api_fetch_json(sb,
+def parse_server_list(data):
+    servers = []
+    for s in (data or {}).get("data", []):
+        attrs = s.get("attributes", {})
+        servers.append({
+            "identifier": attrs.get("identifier", ""),
+            "uuid": attrs.get("uuid", ""),
+            "name": attrs.get("name", ""),
+            "server_type": attrs.get("server_type", ""),
+            "expire": "Unknown",
+            "add_hours": "Unknown",
+        })
+    return servers
+
+
+def parse_pagination(data):
+    pagination = ((data or {}).get("meta") or {}).get("pagination") or {}
+    try:
+        total_pages = max(1, int(pagination.get("total_pages") or 1))
+    except (TypeError, ValueError):
+        total_pages = 1
+    try:
+        total = int(pagination.get("total"))
+    except (TypeError, ValueError):
+        total = None
+    return total_pages, total
+
+
+def apply_server_info(info, data):
+    info["expire"] = data.get("expire", "Unknown")
+    info["add_hours"] = data.get("addHours", "Unknown")
+
+
+def apply_server_infos(servers, infos):
+    for info in servers:
+        d = infos.get(info["uuid"])
+        if d:
+            apply_server_info(info, d)
+
+
+# 服务器列表按页流式产出：第 1 页由调用方同步读取（用于得到总页数），
+# 其余页面和各服务器的 info 在后台并发加载，续期第一个服务器时不必等全部加载完
+class ServerStream:
+    def __init__(self, sb, first_page, xsrf_token=None, http=None):
+        self.sb = sb
+        self.xsrf_token = xsrf_token
+        self.http = http
+        self.total_pages, self.total = parse_pagination(first_page)
+        self._first = parse_server_list(first_page)
+        if self.total is None:
+            self.total = len(self._first)
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        if http is not None and http.usable:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._background, name="weirdhost-servers", daemon=True)
+            self._thread.start()
+
+    def _background(self):
+        # HttpApiClient 的事件循环不能跨线程共用，后台线程使用同一会话 Cookie 的独立客户端
+        client = HttpApiClient(self.http.cookies, self.http.user_agent, self.http.pool_size)
+        try:
+            client._loop.run_until_complete(self._load_pages(client))
+        except Exception as e:
+            print(f"[WARN]   后台加载服务器列表异常: {repr(e)}")
+        finally:
+            client.close()
+            self._queue.put(None)
+
+    async def _load_pages(self, client):
+        sem = asyncio.Semaphore(BATCH_FETCH_CONCURRENCY)
+
+        async def fetch(url):
+            async with sem:
+                return await client._fetch(url)
+
+        async def load(page):
+            if page == 1:
+                servers = self._first
+            else:
+                data = CAPTURE.peek(server_list_url(page))
+                if data is None:
+                    kind, data = await fetch(server_list_url(page))
+                    if kind != "ok":
+                        return page, None, True, kind in ("auth", "challenge")
+                servers = parse_server_list(data)
+            targets = []
+            for s in servers:
+                if not (s.get("uuid") and s.get("server_type") in ("notfree", "free")):
+                    continue
+                # 主线程在页面打开时已经 drain 过，这里只读已捕获的数据
+                captured = CAPTURE.peek(server_info_url(s["uuid"], s["server_type"]))
+                if captured and captured.get("success"):
+                    apply_server_info(s, captured.get("data", {}))
+                else:
+                    targets.append(s)
+            outcomes = await asyncio.gather(*(
+                fetch(server_info_url(s["uuid"], s["server_type"])) for s in targets
+            ))
+            missing = rejected = False
+            for info, (kind, data) in zip(targets, outcomes):
+                if kind == "ok" and data and data.get("success"):
+                    apply_server_info(info, data.get("data", {}))
+                elif kind in ("auth", "challenge"):
+                    missing = rejected = True
+            return page, servers, missing, rejected
+
+        tasks = [asyncio.ensure_future(load(p)) for p in range(1, self.total_pages + 1)]
+        try:
+            for task in tasks:
+                if self._stop.is_set():
+                    break
+                self._queue.put(await task)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _browser_fill(self, page, servers, missing, rejected):
+        # 与 HttpApiClient 相同：只有 401/403 或 CF 挑战才停用 HTTP 通道，其他失败只让这一页走浏览器
+        if rejected and self.http.usable:
+            print(f"[WARN]   HTTP 通道被拒绝，其余请求回退到浏览器内请求")
+            self.http.usable = False
+        if servers is None:
+            print(f"[WARN]   HTTP 通道获取第 {page} 页失败，本页回退到浏览器内请求")
+            data = api_get_json(self.sb, server_list_url(page), self.xsrf_token)
+            if not data:
+                print(f"[ERROR]   第 {page} 页服务器列表获取失败")
+                return []
+            servers = parse_server_list(data)
+            missing = True
+        if missing:
+            unknown = [s for s in servers if s["expire"] == "Unknown"]
+            apply_server_infos(unknown, fetch_server_infos(self.sb, unknown, self.xsrf_token))
+        return servers
+
+    def batches(self):
+        # 每次交出当前已经加载好的全部服务器（至少一页），不等待还在加载的页面
+        if self._thread is not None:
+            done = False
+            while not done:
+                items = [self._queue.get()]
+                while True:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                batch = []
+                for item in items:
+                    if item is None:
+                        done = True
+                        break
+                    batch.extend(self._browser_fill(*item))
+                if batch:
+                    yield batch
+            return
+
+        apply_server_infos(self._first, fetch_server_infos(self.sb, self._first, self.xsrf_token, self.http))
+        yield self._first
+        if self.total_pages > 1:
+            pages = list(range(2, self.total_pages + 1))
+            rest = []
+            datas = api_get_json_many(self.sb, [server_list_url(p) for p in pages], self.xsrf_token, self.http)
+            for page, data in zip(pages, datas):
+                if not data:
+                    print(f"[ERROR]   第 {page} 页服务器列表获取失败")
+                    continue
+                rest.extend(parse_server_list(data))
+            apply_server_infos(rest, fetch_server_infos(self.sb, rest, self.xsrf_token, self.http))
+            yield rest
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            # 排空队列，让后台线程能走到结束
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._thread.join()
+
+
+def fetch_account_email(sb, xsrf_token=None, http=None):
+    email_data = api_get_json(sb,
         f"{API_BASE_URL}/account/activity?sort=-timestamp&page=1&include[]=actor",
-        xsrf_token
+        xsrf_token, http
     )
-    email = None
     if email_data:
         for item in email_data.get("data", []):
             actor = item.get("attributes", {}).get("relationships", {}).get("actor", {})
             if actor.get("object") == "user":
                 email = actor.get("attributes", {}).get("email")
                 if email:
-                    break
-    result["email"] = email or "Unknown"
+                    return email
+    return None
 
-    servers = []
-    for s in server_data.get("data", []):
-        attrs = s.get("attributes", {})
-        stype = attrs.get("server_type", "")
-        info = {
-            "identifier": attrs.get("identifier", ""),
-            "uuid": attrs.get("uuid", ""),
-            "name": attrs.get("name", ""),
-            "server_type": stype,
-            "expire": "Unknown",
-            "add_hours": "Unknown",
-        }
-        if attrs.get("uuid") and stype in ("notfree", "free"):
-            ep = f"/freeservers/{attrs['uuid']}/info" if stype == "free" else f"/notfreeservers/{attrs['uuid']}/info"
-            si = api_fetch_json(sb, f"{API_BASE_URL}{ep}", xsrf_token)
-            if si and si.get("success"):
-                d = si.get("data", {})
-                info["expire"] = d.get("expire", "Unknown")
-                info["add_hours"] = d.get("addHours", "Unknown")
-        servers.append(info)
 
-    result["servers"] = servers
+def stream_account_servers(sb, xsrf_token=None, http=None):
+    server_data = api_get_json(sb, server_list_url(1), xsrf_token, http)
+    if not server_data or server_data.get("error") == "unauthorized":
+        return None
+    email = fetch_account_email(sb, xsrf_token, http)
+    return {"email": email or "Unknown", "servers": ServerStream(sb, server_data, xsrf_token, http)}
+
+
+def fetch_account_overview(sb, xsrf_token=None, http=None):
+    overview = stream_account_servers(sb, xsrf_token, http)
+    if overview is None:
+        return None
+    stream = overview["servers"]
+    try:
+        overview["servers"] = list(stream)
+    finally:
+        stream.close()
+    return overview
+
+
+def process_account_servers(sb, account, account_index, result, xsrf_token, http=None, renew=True):
+    remark = result["remark"]
+    cookie_env = result["cookie_env"]
+    cookie_str = account.get("cookie_str", "")
+    cookie_name = account.get("cookie_name", "")
+    cookie_value = account.get("cookie_value", "")
+
+    # Step 3: 获取信息
+    print(f"[INFO] [步骤3] 获取账号信息...")
+    RUN_TIMER.enter("server list", server="-")
+    overview = stream_account_servers(sb, xsrf_token, http)
+    if not overview:
+        print(f"[ERROR]   获取服务器列表失败")
+        result["status"] = "error"
+        result["message"] = "无法获取服务器列表"
+        return result
+
+    email = overview["email"]
+    stream = overview["servers"]
+    result["email"] = email
 
     if email and email != "Unknown":
         print(f"[INFO] 邮箱: {mask_email(email)}")
 
-    if not servers:
+    try:
+        if not renew:
+            servers = list(stream)
+            result["servers"] = servers
+            if not servers:
+                print(f"[WARN] 该账号下没有服务器")
+                result["status"] = "no_server"
+                result["message"] = "该账号下没有服务器"
+                return result
+            print(f"[INFO] 找到 {len(servers)} 个服务器:")
+            for s in servers:
+                print(f"  - {mask_server_id(s['identifier'])} [{s['server_type']}] {s['name']} | 到期: {s['expire']}")
+            result["status"] = "checked"
+            result["message"] = f"{len(servers)} 个服务器（只读）"
+            return result
+
+        # Step 4: 逐个处理服务器（列表其余页面与服务器信息在后台继续加载）
+        if stream.total_pages > 1:
+            print(f"[INFO] 共 {stream.total} 个服务器，{stream.total_pages} 页")
+        print(f"[INFO] [步骤4] 已加载的服务器按剩余时间从少到多处理续期...")
+        server_results = []
+        plan = account.get("plan")
+        processed = False
+        # 只在已加载的批次内排序，不为了全局排序等待其余页面；后台加载的页面在处理期间陆续到达
+        servers = (
+            srv for batch in stream.batches()
+            for srv in sorted(batch, key=lambda srv: server_urgency(srv["expire"]))
+        )
+        for srv_idx, server in enumerate(servers):
+            print(f"\n  - {mask_server_id(server['identifier'])} [{server['server_type']}] "
+                  f"{server['name']} | 到期: {server['expire']}")
+            ss_prefix = f"acc{account_index + 1}_srv{srv_idx + 1}"
+            done = JOURNAL.server_done(account, server["uuid"])
+            if done:
+                print(f"  [INFO] {mask_server_id(server['identifier'])}: {JOURNAL_SKIP_MESSAGE}（{done['status']}）")
+                server_results.append({
+                    "server_id": server["identifier"], "server_uuid": server["uuid"],
+                    "server_type": server["server_type"], "server_name": server["name"],
+                    "add_hours": server["add_hours"], "status": "skipped",
+                    "original_expiry": server["expire"],
+                    "new_expiry": done.get("new_expiry") or server["expire"],
+                    "message": JOURNAL_SKIP_MESSAGE, "screenshot": None, "cookie_updated": False,
+                })
+                continue
+            if plan is not None:
+                srv_due, reason = plan_server_due(server["expire"], server["add_hours"],
+                                                  plan.get(server["uuid"], "new"))
+                if not srv_due:
+                    print(f"  [INFO] {mask_server_id(server['identifier'])}: {PLAN_SKIP_MESSAGE}（{reason}）")
+                    server_results.append({
+                        "server_id": server["identifier"], "server_uuid": server["uuid"],
+                        "server_type": server["server_type"], "server_name": server["name"],
+                        "add_hours": server["add_hours"], "status": "skipped",
+                        "original_expiry": server["expire"], "new_expiry": server["expire"],
+                        "message": PLAN_SKIP_MESSAGE, "screenshot": None, "cookie_updated": False,
+                    })
+                    continue
+            if not BUDGET.can_start("server"):
+                print(f"  [WARN] {mask_server_id(server['identifier'])}: {DEFERRED_MESSAGE}"
+                      f"（剩余预算 {BUDGET.remaining():.0f}s，预计 {BUDGET.costs['server']:.0f}s）")
+                server_results.append({
+                    "server_id": server["identifier"], "server_uuid": server["uuid"],
+                    "server_type": server["server_type"], "server_name": server["name"],
+                    "add_hours": server["add_hours"], "status": "deferred",
+                    "original_expiry": server["expire"], "new_expiry": server["expire"],
+                    "message": DEFERRED_MESSAGE, "screenshot": None, "cookie_updated": False,
+                })
+                continue
+            srv_start = time.time()
+            if processed and pacing_enabled():
+                prev = server_results[-1] if server_results else {}
+                wait = random.randint(2, 4) if prev.get("status") == "skipped" else random.randint(5, 10)
+                print(f"\n  [INFO] 等待 {wait} 秒后处理下一个服务器...")
+                RUN_TIMER.enter("wait", server="-")
+                time.sleep(wait)
+            srv_result = process_single_server(
+                sb, server, cookie_name, cookie_value, cookie_str, cookie_env, remark, ss_prefix, http
+            )
+            processed = True
+            BUDGET.observe("server", time.time() - srv_start)
+            JOURNAL.record_server(account, srv_result)
+            server_results.append(srv_result)
+            if srv_result.get("cookie_staged"):
+                result["cookie_staged"] = True
+    finally:
+        stream.close()
+
+    if not server_results:
         print(f"[WARN] 该账号下没有服务器")
         result["status"] = "no_server"
         result["message"] = "该账号下没有服务器"
         return result
 
-    print(f"[INFO] 找到 {len(servers)} 个服务器:")
-    for s in servers:
-        print(f"  - {mask_server_id(s['identifier'])} [{s['server_type']}] {s['name']} | 到期: {s['expire']}")
-
-    # Step 4: 逐个处理服务器
-    print(f"[INFO] [步骤4] 逐个处理服务器续期...")
-    server_results = []
-    for srv_idx, server in enumerate(servers):
-        ss_prefix = f"acc{account_index + 1}_srv{srv_idx + 1}"
-        srv_result = process_single_server(
-            sb, server, cookie_name, cookie_value, cookie_str, cookie_env, remark, ss_prefix
-        )
-        server_results.append(srv_result)
-        if srv_result.get("cookie_updated"):
-            result["cookie_updated"] = True
-        if srv_idx < len(servers) - 1:
-            wait = random.randint(2, 4) if srv_result.get("status") == "skipped" else random.randint(5, 10)
-            print(f"\n  [INFO] 等待 {wait} 秒后处理下一个服务器...")
-            time.sleep(wait)
-
     result["servers"] = server_results
 
     statuses = [s["status"] for s in server_results]
@@ -1169,6 +3410,9 @@ def process_single_account(sb, account, account_index):
     elif all(s == "skipped" for s in statuses):
         result["status"] = "skipped"
         result["message"] = "所有服务器均跳过"
+    elif all(s in ("skipped", "deferred") for s in statuses):
+        result["status"] = "deferred"
+        result["message"] = f"{statuses.count('deferred')} 个服务器推迟到下次运行"
     elif "cooldown" in statuses:
         result["status"] = "cooldown"
         result["message"] = "冷却期内"
@@ -1182,6 +3426,437 @@ def process_single_account(sb, account, account_index):
     return result
 
 
+# ============================================================
+#  只读状态检查（优先走 HTTP，无需浏览器）
+# ============================================================
+
+def check_account_status_http(account, account_index):
+    session_state = load_session_state(account)
+    http = open_http_client(session_state, account)
+    if not http:
+        return None
+    try:
+        print(f"[INFO] [{account_index + 1}] {mask_remark(account['remark'])}: 使用已保存会话读取状态...")
+        overview = fetch_account_overview(None, http=http)
+    finally:
+        http.close()
+    if not overview:
+        return None
+    return {
+        "remark": account["remark"],
+        "cookie_env": account.get("cookie_env", ""),
+        "email": overview["email"],
+        "status": "checked" if overview["servers"] else "no_server",
+        "message": f"{len(overview['servers'])} 个服务器（HTTP）",
+        "servers": overview["servers"],
+        "cookie_updated": False,
+        "account_index": account_index,
+    }
+
+
+def print_status_table(results):
+    print(f"\n{'=' * 60}")
+    print("[INFO] 服务器状态")
+    print(f"{'=' * 60}")
+    for r in results:
+        print(f"  {mask_remark(r.get('remark', '?'))} ({mask_email(r.get('email', ''))}) | {r.get('message', '')}")
+        for s in r.get("servers", []):
+            expiry = s.get("expire", s.get("original_expiry", "Unknown"))
+            rd = format_remaining_days(get_remaining_days(expiry))
+            print(f"    - {mask_server_id(s.get('identifier', s.get('server_id', '')))} "
+                  f"[{s.get('server_type', '?')}] 到期: {expiry} | "
+                  f"剩余: {calculate_remaining_time(expiry)} ({rd}天)")
+
+
+# ============================================================
+#  续期计划（启动浏览器前，基于持久化的到期数据）
+# ============================================================
+
+STATE_FILE = os.environ.get("WEIRDHOST_STATE_FILE", ".weirdhost_state.json")
+SETTLED_STATUSES = ("success", "cooldown", "skipped")
+PLAN_SKIP_MESSAGE = "计划跳过：未进入续期窗口"
+
+
+def planning_enabled():
+    return (os.environ.get("WEIRDHOST_PLAN", "1").strip() != "0"
+            and os.environ.get("WEIRDHOST_FORCE", "").strip() != "1")
+
+
+def account_key(account):
+    return account.get("cookie_env") or account.get("remark", "")
+
+
+def load_run_state():
+    try:
+        with open(STATE_FILE) as f:
+            state = json.load(f)
+    except Exception:
+        state = {}
+    state.setdefault("accounts", {})
+    state.setdefault("servers", {})
+    return state
+
+
+def save_run_state(state):
+    # 续期接口可能由并行的子进程学到并写入，主进程手里的旧状态不能覆盖它
+    on_disk = load_run_state().get("renew_endpoint") or {}
+    if on_disk.get("learned_at", 0) > (state.get("renew_endpoint") or {}).get("learned_at", 0):
+        state["renew_endpoint"] = on_disk
+    try:
+        tmp = f"{STATE_FILE}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, STATE_FILE)
+    except Exception as e:
+        print(f"[WARN] 状态文件保存失败: {e}")
+
+
+def record_account_results(state, account, result):
+    servers = result.get("servers", [])
+    if not servers and result.get("status") != "no_server":
+        return
+    now = time.time()
+    uuids = []
+    for s in servers:
+        uuid = s.get("server_uuid") or s.get("uuid")
+        if not uuid:
+            continue
+        uuids.append(uuid)
+        rec = state["servers"].setdefault(uuid, {})
+        expire = s.get("new_expiry") or s.get("expire")
+        if expire and expire != "Unknown":
+            rec["expire"] = expire
+        if s.get("add_hours") not in (None, "Unknown"):
+            rec["add_hours"] = s["add_hours"]
+        rec["account"] = account_key(account)
+        rec["identifier"] = s.get("server_id") or s.get("identifier", "")
+        rec["server_type"] = s.get("server_type", "")
+        rec["updated_at"] = now
+        if "status" in s and s.get("message") != PLAN_SKIP_MESSAGE:
+            rec["last_status"] = s["status"]
+            rec["last_attempt_at"] = now
+    acc_rec = {"uuids": uuids, "updated_at": now}
+    if result.get("email") and result["email"] != "Unknown":
+        acc_rec["email"] = result["email"]
+    state["accounts"][account_key(account)] = acc_rec
+
+
+def plan_server_due(expire, add_hours, last_status):
+    if last_status not in SETTLED_STATUSES:
+        return (True, f"上次结果: {last_status or '无记录'}")
+    rd = get_remaining_days(expire)
+    if rd is None:
+        return (True, "到期时间未知")
+    remaining_h = rd * 24
+    if remaining_h <= env_float("WEIRDHOST_RUN_INTERVAL_HOURS", 24):
+        return (True, "下次运行前到期")
+    window = env_float("WEIRDHOST_RENEW_WINDOW_HOURS", 0)
+    if window <= 0:
+        try:
+            window = float(add_hours)
+        except (TypeError, ValueError):
+            window = 24
+    if remaining_h <= window:
+        return (True, f"剩余 {remaining_h:.1f}h ≤ 续期窗口 {window:g}h")
+    return (False, f"剩余 {remaining_h:.1f}h > 续期窗口 {window:g}h")
+
+
+def plan_accounts(state, indexed_accounts):
+    max_age = env_float("WEIRDHOST_PLAN_MAX_AGE_HOURS", 72) * 3600
+    now = time.time()
+    due_accounts = []
+    for account_index, account in indexed_accounts:
+        acc_rec = state["accounts"].get(account_key(account))
+        label = f"[{account_index + 1}] {mask_remark(account['remark'])}"
+        if not acc_rec or now - acc_rec.get("updated_at", 0) > max_age:
+            print(f"[INFO] [计划] {label}: 无近期记录，需要运行")
+            due_accounts.append((account_index, account))
+            continue
+        known = {}
+        due = False
+        for uuid in acc_rec.get("uuids", []):
+            rec = state["servers"].get(uuid, {})
+            known[uuid] = rec.get("last_status")
+            srv_due, reason = plan_server_due(rec.get("expire"), rec.get("add_hours"), rec.get("last_status"))
+            mark = "需要续期" if srv_due else "跳过"
+            print(f"[INFO] [计划] {label} {mask_server_id(rec.get('identifier', uuid))}: {mark}（{reason}）")
+            due = due or srv_due
+        if due:
+            account["plan"] = known
+            due_accounts.append((account_index, account))
+    return due_accounts
+
+
+def refresh_state_via_http(state, indexed_accounts):
+    for account_index, account in indexed_accounts:
+        status = check_account_status_http(account, account_index)
+        if status:
+            record_account_results(state, account, status)
+
+
+# ============================================================
+#  紧急度调度与运行时间预算（先处理快到期的服务器，做不完的留到下次运行）
+# ============================================================
+
+DEFERRED_MESSAGE = "运行时间预算不足，推迟到下次运行"
+# 到期时间未知时按剩余 1 天排序：排在一天内到期的服务器之后，不会挤到真正紧急的前面
+UNKNOWN_URGENCY_DAYS = 1.0
+DEFAULT_COSTS = {"account": 60.0, "server": 45.0}
+
+
+def server_urgency(expire):
+    rd = get_remaining_days(expire)
+    return UNKNOWN_URGENCY_DAYS if rd is None else rd
+
+
+def account_urgency(state, account):
+    acc_rec = state["accounts"].get(account_key(account))
+    if not acc_rec or not acc_rec.get("uuids"):
+        return UNKNOWN_URGENCY_DAYS
+    return min(server_urgency(state["servers"].get(uuid, {}).get("expire")) for uuid in acc_rec["uuids"])
+
+
+def order_by_urgency(state, indexed_accounts):
+    # 服务器只能在登录对应账号后处理，所以全局顺序落实为：账号按其最紧急的服务器排序，账号内服务器再按剩余时间排序
+    ranked = sorted(indexed_accounts, key=lambda item: account_urgency(state, item[1]))
+    if [i for i, _ in ranked] != [i for i, _ in indexed_accounts]:
+        print("[INFO] 按紧急度排序: " + ", ".join(
+            f"[{i + 1}] {format_remaining_days(account_urgency(state, a))}天" for i, a in ranked
+        ))
+    return ranked
+
+
+class RunBudget:
+    # 退出前 flush_github_secrets() 与 shutdown_dispatcher() 各最多等待 60 秒，要留在预算之外
+    TEARDOWN_SECONDS = 120
+
+    def __init__(self):
+        self.deadline = None
+        self.started = False
+        self.costs = dict(DEFAULT_COSTS)
+        self.server_seconds = 0.0
+
+    def start(self):
+        # 截止时间写入环境变量，spawn 出的并行子进程沿用主进程的截止时间
+        self.started = True
+        deadline = env_float("WEIRDHOST_RUN_DEADLINE", 0)
+        if deadline <= 0:
+            minutes = env_float("WEIRDHOST_RUN_BUDGET_MIN", 27)
+            if minutes > 0:
+                # 工作流的 timeout-minutes 从 Job 开始计时，包含安装依赖的步骤，所以优先从 Job 开始时间算起
+                started = env_float("WEIRDHOST_JOB_STARTED", 0) or time.time()
+                deadline = started + minutes * 60 - self.TEARDOWN_SECONDS
+                os.environ["WEIRDHOST_RUN_DEADLINE"] = str(deadline)
+        self.deadline = deadline if deadline > 0 else None
+        for kind, seconds in (load_run_state().get("costs") or {}).items():
+            if kind in self.costs:
+                self.costs[kind] = float(seconds)
+
+    def remaining(self):
+        if not self.started:
+            self.start()
+        return None if self.deadline is None else self.deadline - time.time()
+
+    def can_start(self, kind, extra=0.0):
+        remaining = self.remaining()
+        return remaining is None or self.costs[kind] + extra <= remaining
+
+    def observe(self, kind, seconds):
+        # 指数滑动平均，个别异常慢的服务器不会让估计值一下子失真
+        self.costs[kind] = round(0.7 * self.costs[kind] + 0.3 * seconds, 1)
+        if kind == "server":
+            self.server_seconds += seconds
+
+    def merge(self, costs):
+        for kind, seconds in (costs or {}).items():
+            if kind in self.costs:
+                self.costs[kind] = round((self.costs[kind] + seconds) / 2, 1)
+
+    def save(self, state):
+        state["costs"] = dict(self.costs)
+
+
+BUDGET = RunBudget()
+
+
+def deferred_account_result(account, account_index):
+    return {
+        "remark": account.get("remark", f"账号{account_index + 1}"),
+        "cookie_env": account.get("cookie_env", ""),
+        "email": "Unknown",
+        "status": "deferred",
+        "message": DEFERRED_MESSAGE,
+        "servers": [],
+        "cookie_updated": False,
+        "account_index": account_index,
+    }
+
+
+def print_deferred(results, state):
+    lines = []
+    for r in results:
+        label = mask_remark(r.get("remark", "?"))
+        if r.get("status") == "deferred" and not r.get("servers"):
+            acc_rec = state["accounts"].get(r.get("cookie_env") or r.get("remark", ""), {})
+            for uuid in acc_rec.get("uuids", []) or [None]:
+                rec = state["servers"].get(uuid, {}) if uuid else {}
+                ident = mask_server_id(rec.get("identifier", uuid)) if uuid else "全部服务器"
+                lines.append(f"  ⏸️ {label} {ident} | 剩余 {calculate_remaining_time(rec.get('expire', 'Unknown'))}")
+            continue
+        for srv in r.get("servers", []):
+            if srv.get("status") == "deferred":
+                lines.append(f"  ⏸️ {label} {mask_server_id(srv.get('server_id', ''))} | "
+                             f"剩余 {calculate_remaining_time(srv.get('original_expiry', 'Unknown'))}")
+    if lines:
+        print(f"\n[WARN] {len(lines)} 项因运行时间预算推迟到下次运行:")
+        for line in lines:
+            print(line)
+
+
+# ============================================================
+#  检查点日志（每个结果立即落盘，崩溃重启和当天重跑时跳过已完成项）
+# ============================================================
+
+JOURNAL_DIR = os.environ.get("WEIRDHOST_JOURNAL_DIR", ".weirdhost_journal")
+JOURNAL_KEEP_DAYS = 7
+JOURNAL_SKIP_MESSAGE = "今日已处理（检查点）"
+JOURNAL_DONE_STATUSES = ("success", "cooldown")
+BROWSER_CRASH_MARKERS = (
+    "invalid session id", "no such window", "chrome not reachable", "session deleted",
+    "target window already closed", "disconnected", "connection refused",
+    "max retries exceeded", "remote end closed connection",
+)
+
+
+class BrowserCrashed(Exception):
+    pass
+
+
+def browser_alive(sb):
+    try:
+        sb.driver.execute_script("return 1;")
+        return True
+    except Exception:
+        return False
+
+
+def is_browser_crash(exc, sb=None):
+    if isinstance(exc, BrowserCrashed):
+        return True
+    text = repr(exc).lower()
+    if any(m in text for m in BROWSER_CRASH_MARKERS):
+        return True
+    return sb is not None and not browser_alive(sb)
+
+
+class CheckpointJournal:
+    def __init__(self, directory=JOURNAL_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._day = None
+        self._servers = {}
+        self._accounts = {}
+
+    def _path(self, day):
+        return os.path.join(self.directory, f"journal-{day}.jsonl")
+
+    def _load(self):
+        day = datetime.now().strftime("%Y-%m-%d")
+        if self._day == day:
+            return
+        self._day = day
+        self._servers = {}
+        self._accounts = {}
+        try:
+            with open(self._path(day)) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("kind") == "server":
+                        self._servers[(entry["account"], entry["uuid"])] = entry
+                    elif entry.get("kind") == "account":
+                        self._accounts[entry["account"]] = entry
+        except OSError:
+            pass
+        self._prune()
+
+    def _prune(self):
+        cutoff = (datetime.now() - timedelta(days=JOURNAL_KEEP_DAYS)).strftime("%Y-%m-%d")
+        try:
+            for name in os.listdir(self.directory):
+                if name.startswith("journal-") and name[len("journal-"):-len(".jsonl")] < cutoff:
+                    os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _append(self, entry):
+        entry["t"] = time.time()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(self._day), "a") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(f"[WARN]   检查点写入失败: {e}")
+
+    def record_server(self, account, srv_result):
+        uuid = srv_result.get("server_uuid")
+        if not uuid:
+            return
+        entry = {
+            "kind": "server", "account": account_key(account), "uuid": uuid,
+            "status": srv_result.get("status"), "new_expiry": srv_result.get("new_expiry"),
+        }
+        with self._lock:
+            self._load()
+            self._servers[(entry["account"], uuid)] = entry
+            self._append(entry)
+
+    def record_account(self, account, result):
+        servers = result.get("servers", [])
+        statuses = [s.get("status") for s in servers]
+        # 计划跳过的服务器当天稍后可能进入续期窗口，有这类服务器的账号不算已完成
+        complete = (result.get("status") in ("success", "cooldown", "skipped", "no_server")
+                    and all(st in SETTLED_STATUSES for st in statuses)
+                    and not any(s.get("message") == PLAN_SKIP_MESSAGE for s in servers))
+        entry = {"kind": "account", "account": account_key(account),
+                 "status": result.get("status"), "complete": complete}
+        with self._lock:
+            self._load()
+            self._accounts[entry["account"]] = entry
+            self._append(entry)
+
+    def server_done(self, account, uuid):
+        with self._lock:
+            self._load()
+            entry = self._servers.get((account_key(account), uuid))
+        if entry and entry.get("status") in JOURNAL_DONE_STATUSES:
+            return entry
+        return None
+
+    def account_complete(self, account):
+        with self._lock:
+            self._load()
+            entry = self._accounts.get(account_key(account))
+        return bool(entry and entry.get("complete"))
+
+
+JOURNAL = CheckpointJournal()
+
+
+def skip_completed_accounts(indexed_accounts):
+    pending = []
+    for account_index, account in indexed_accounts:
+        if JOURNAL.account_complete(account):
+            print(f"[INFO] [{account_index + 1}] {mask_remark(account['remark'])}: {JOURNAL_SKIP_MESSAGE}")
+        else:
+            pending.append((account_index, account))
+    return pending
+
+
 # ============================================================
 #  单账号 TG 通知
 # ============================================================
@@ -1189,7 +3864,6 @@ def process_single_account(sb, account, account_index):
 def send_account_notification(result):
     email = result.get("email", "Unknown")
     remark = result.get("remark", "")
-    cookie_updated = result.get("cookie_updated", False)
     servers = result.get("servers", [])
     status = result.get("status", "unknown")
 
@@ -1202,6 +3876,9 @@ def send_account_notification(result):
     elif status == "no_server":
         lines.append("状态：⚠️ 没有服务器")
         screenshot = None
+    elif status == "deferred" and not servers:
+        lines.append(f"状态：⏸️ {DEFERRED_MESSAGE}")
+        screenshot = None
     else:
         for s in servers:
             lines.append("")
@@ -1229,6 +3906,10 @@ def send_account_notification(result):
                 expiry = s.get("original_expiry", "Unknown")
                 lines.append(f"剩余：{calculate_remaining_time(expiry)}")
                 lines.append("提示：冷却中，请稍后再试")
+            elif srv_status == "deferred":
+                lines.append("状态：⏸️ 推迟")
+                lines.append(f"剩余：{calculate_remaining_time(s.get('original_expiry', 'Unknown'))}")
+                lines.append(f"原因：{s.get('message', DEFERRED_MESSAGE)}")
             elif srv_status == "skipped":
                 lines.append("状态：⏭️ 跳过")
                 expiry = s.get("original_expiry", s.get("new_expiry", "Unknown"))
@@ -1238,40 +3919,465 @@ def send_account_notification(result):
                 lines.append(f"状态：❌ {srv_status}")
                 lines.append(f"信息：{s.get('message', '未知')}")
 
-    if cookie_updated:
-        lines.append("")
-        lines.append("🔑 Cookie 已自动更新")
-
     lines.append("")
     lines.append("Weirdhost Auto Renew")
 
     message = "\n".join(lines)
 
-    screenshot = None
+    photo = None
     for s in servers:
-        if s["status"] in ("success", "cooldown", "error", "timeout"):
-            if s.get("screenshot") and os.path.exists(s["screenshot"]):
+        if s["status"] in ("success", "cooldown", "error", "timeout") and s.get("screenshot"):
+            photo = SCREENSHOTS.get(s["screenshot"])
+            if photo is None and os.path.exists(s["screenshot"]):
+                photo = s["screenshot"]
+            if photo is not None:
                 screenshot = s["screenshot"]
                 break
 
-    if screenshot:
-        sync_tg_notify_photo(screenshot, message)
+    if photo is not None:
+        sync_tg_notify_photo(photo, message, os.path.basename(screenshot))
     else:
         sync_tg_notify(message)
 
 
+# Cookie 写入在运行结束时统一进行，单账号通知发出时还不知道结果，写入完成后再单独汇总
+def apply_cookie_outcomes(results, outcomes):
+    for r in results:
+        if r.get("cookie_staged") and r.get("cookie_env", "") in outcomes:
+            r["cookie_updated"] = bool(outcomes[r["cookie_env"]])
+
+
+def send_cookie_notification(results):
+    staged = [r for r in results if r.get("cookie_staged")]
+    if not staged:
+        return
+    lines = ["🔑 <b>Cookie 更新</b>", ""]
+    for r in staged:
+        email = r.get("email", "Unknown")
+        account_display = email if email and email != "Unknown" else r.get("remark", "")
+        if r.get("cookie_updated"):
+            lines.append(f"✅ {account_display}：已自动更新")
+        else:
+            lines.append(f"❌ {account_display}：更新失败，请手动更新 {r.get('cookie_env', '')}")
+    lines.append("")
+    lines.append("Weirdhost Auto Renew")
+    sync_tg_notify("\n".join(lines))
+
+
+# ============================================================
+#  隔离浏览器上下文（同一个 Chrome 内每个账号一个 CDP browser context）
+# ============================================================
+
+def contexts_enabled():
+    return os.environ.get("WEIRDHOST_CONTEXTS", "").strip() == "1"
+
+
+def window_handle_for(sb, target_id):
+    # chromedriver 的窗口句柄就是 CDP targetId（旧版本带 "CDwindow-" 前缀）
+    for handle in sb.driver.window_handles:
+        if handle.upper().endswith(target_id.upper()):
+            return handle
+    return None
+
+
+def set_target_window_state(sb, target_id, state):
+    try:
+        window = sb.driver.execute_cdp_cmd("Browser.getWindowForTarget", {"targetId": target_id})
+        sb.driver.execute_cdp_cmd("Browser.setWindowBounds", {
+            "windowId": window["windowId"], "bounds": {"windowState": state},
+        })
+    except Exception:
+        pass
+
+
+def session_cookie_params(session_state):
+    params = []
+    for c in (session_state or {}).get("cookie_list") or []:
+        param = {
+            "name": c["name"],
+            "value": c.get("value", ""),
+            "domain": c.get("domain", DOMAIN),
+            "path": c.get("path", "/"),
+            "secure": c.get("secure", False),
+            "httpOnly": c.get("httpOnly", False),
+        }
+        if c.get("expiry"):
+            param["expires"] = c["expiry"]
+        if c.get("sameSite"):
+            param["sameSite"] = c["sameSite"]
+        params.append(param)
+    return params
+
+
+class AccountContext:
+    def __init__(self, sb, session_state=None, url="about:blank", minimize=False):
+        self.context_id = sb.driver.execute_cdp_cmd("Target.createBrowserContext", {})["browserContextId"]
+        cookies = restorable_cookie_params(sb, session_state) if session_state else []
+        if cookies:
+            sb.driver.execute_cdp_cmd("Storage.setCookies", {
+                "cookies": cookies, "browserContextId": self.context_id,
+            })
+        self.target_id = sb.driver.execute_cdp_cmd("Target.createTarget", {
+            "url": url, "browserContextId": self.context_id, "background": True,
+        })["targetId"]
+        self.preloaded = url != "about:blank"
+        self.minimized = minimize
+        if minimize:
+            # 有界面时预加载的窗口先最小化，XTest 按可见窗口找 Chrome，不能点到它上面
+            set_target_window_state(sb, self.target_id, "minimized")
+
+    def page_targets(self, sb):
+        infos = sb.driver.execute_cdp_cmd("Target.getTargets", {}).get("targetInfos", [])
+        return [t["targetId"] for t in infos
+                if t.get("type") == "page" and t.get("browserContextId") == self.context_id]
+
+    def activate(self, sb):
+        # uc_open_with_reconnect 会在上下文内新开标签页并关掉旧的，之后按 CDP target 找回当前标签页
+        targets = self.page_targets(sb)
+        if self.target_id not in targets and targets:
+            self.target_id = targets[-1]
+        handle = window_handle_for(sb, self.target_id)
+        if handle is None:
+            raise RuntimeError(f"找不到浏览器上下文 {self.context_id} 的标签页")
+        if handle != sb.driver.current_window_handle:
+            sb.driver.switch_to.window(handle)
+        if self.minimized:
+            set_target_window_state(sb, self.target_id, "normal")
+            self.minimized = False
+        if _xtest_input is not None:
+            _xtest_input._window = None
+
+    def dispose(self, sb, home_handle):
+        try:
+            sb.driver.switch_to.window(home_handle)
+        except Exception:
+            pass
+        try:
+            sb.driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": self.context_id})
+        except Exception as e:
+            print(f"[WARN] 浏览器上下文释放失败: {e}")
+
+
+ACTIVE_CONTEXT = None
+
+
+# 账号按顺序在各自的上下文里处理；当前账号开始时，下一个有会话缓存的账号已经在后台标签页
+# 里加载站点，轮到它时页面通常已经就绪，省掉一次 uc_open_with_reconnect
+class ContextPool:
+    def __init__(self, sb, headless=False):
+        global ACTIVE_CONTEXT
+        ACTIVE_CONTEXT = None
+        self.sb = sb
+        self.headless = headless
+        self.home = sb.driver.current_window_handle
+        self.active = None
+        self.prepared = {}
+        if not headless:
+            home_target = self.home.upper().replace("CDWINDOW-", "")
+            set_target_window_state(sb, home_target, "minimized")
+
+    def enter(self, account, next_account=None):
+        global ACTIVE_CONTEXT
+        ctx = self.prepared.pop(account_key(account), None) or AccountContext(self.sb)
+        ctx.activate(self.sb)
+        self.active = ACTIVE_CONTEXT = ctx
+        if next_account is not None and account_key(next_account) not in self.prepared:
+            session = load_session_state(next_account)
+            if session:
+                try:
+                    self.prepared[account_key(next_account)] = AccountContext(
+                        self.sb, session, f"{SITE_URL}/", minimize=not self.headless
+                    )
+                except Exception as e:
+                    print(f"[WARN] 预加载下一个账号失败: {e}")
+        return ctx
+
+    def leave(self):
+        global ACTIVE_CONTEXT
+        if self.active is not None:
+            self.active.dispose(self.sb, self.home)
+        self.active = ACTIVE_CONTEXT = None
+
+    def discard(self, account):
+        ctx = self.prepared.pop(account_key(account), None)
+        if ctx is not None:
+            ctx.dispose(self.sb, self.home)
+
+    def close(self):
+        self.leave()
+        for ctx in self.prepared.values():
+            ctx.dispose(self.sb, self.home)
+        self.prepared.clear()
+
+
+# ============================================================
+#  浏览器运行
+# ============================================================
+
+SB_CHROMIUM_ARGS = "--disable-dev-shm-usage,--no-sandbox,--disable-gpu,--disable-software-rasterizer,--disable-background-timer-throttling"
+
+
+def max_browser_restarts():
+    try:
+        return max(0, int(os.environ.get("WEIRDHOST_MAX_RESTARTS", "2").strip() or 2))
+    except ValueError:
+        return 2
+
+
+def error_account_result(account, account_index, error):
+    return {
+        "remark": account.get("remark", f"账号{account_index + 1}"),
+        "cookie_env": account.get("cookie_env", ""),
+        "email": "Unknown",
+        "status": "error",
+        "message": f"处理异常: {repr(error)[:100]}",
+        "servers": [],
+        "cookie_updated": False,
+    }
+
+
+def run_accounts_in_browser(indexed_accounts, notify=True, renew=True, headless=False):
+    from seleniumbase import SB
+
+    results = []
+    remaining = list(indexed_accounts)
+    mode = configure_input(headless)
+    restarts = 0
+    for _, account in remaining:
+        if account.get("base_cookie"):
+            FILE_COOKIE_BASES[account["cookie_env"]] = account["base_cookie"]
+    agent = session_user_agent(remaining)
+    while remaining:
+        RUN_TIMER.enter("browser startup", account="-")
+        try:
+            with SB(
+                uc=True,
+                test=True,
+                locale="ko",
+                headless=headless,
+                agent=agent,
+                log_cdp=CAPTURE.usable,
+                chromium_arg=SB_CHROMIUM_ARGS
+            ) as sb:
+                print(f"\n[INFO] 浏览器已启动（{'无头' if headless else '有界面'}，输入方式 {mode}）")
+                if agent:
+                    print(f"[INFO] 使用会话缓存的 User-Agent: {agent}")
+                contexts = ContextPool(sb, headless) if contexts_enabled() else None
+                try:
+                    while remaining:
+                        account_index, account = remaining[0]
+                        if renew and not BUDGET.can_start("account", BUDGET.costs["server"]):
+                            print(f"\n[WARN] {mask_remark(account['remark'])}: {DEFERRED_MESSAGE}")
+                            if contexts is not None:
+                                contexts.discard(account)
+                            result = deferred_account_result(account, account_index)
+                            results.append(result)
+                            remaining.pop(0)
+                            if notify:
+                                send_account_notification(result)
+                            continue
+                        account_start = time.time()
+                        server_seconds = BUDGET.server_seconds
+                        context = None
+                        if contexts is not None:
+                            context = contexts.enter(account, remaining[1][1] if len(remaining) > 1 else None)
+                        try:
+                            result = process_single_account(sb, account, account_index, renew, context)
+                        except Exception as e:
+                            # 只有浏览器崩溃才重启 Chrome 重跑本账号，普通异常记为该账号出错后继续下一个
+                            if is_browser_crash(e, sb):
+                                raise
+                            import traceback
+                            print(f"\n[ERROR] {mask_remark(account['remark'])} 处理异常: {repr(e)}")
+                            traceback.print_exc()
+                            result = error_account_result(account, account_index, e)
+                        finally:
+                            if contexts is not None:
+                                contexts.leave()
+                        BUDGET.observe("account", time.time() - account_start - (BUDGET.server_seconds - server_seconds))
+                        result["account_index"] = account_index
+                        persist_result_screenshots(result)
+                        if renew:
+                            JOURNAL.record_account(account, result)
+                        results.append(result)
+                        remaining.pop(0)
+
+                        if notify:
+                            send_account_notification(result)
+
+                        if remaining and pacing_enabled():
+                            if result.get("status") == "skipped":
+                                wait_time = random.randint(2, 4)
+                            else:
+                                wait_time = random.randint(5, 10)
+                            print(f"\n[INFO] 等待 {wait_time} 秒后处理下一个账号...")
+                            RUN_TIMER.enter("wait", account="-")
+                            time.sleep(wait_time)
+                finally:
+                    # 推迟 / 跳过的账号可能已有预加载的上下文，退出前统一释放
+                    if contexts is not None:
+                        contexts.close()
+
+        except Exception as e:
+            import traceback
+            print(f"\n[ERROR] 浏览器异常: {repr(e)}")
+            traceback.print_exc()
+            if not remaining:
+                break
+            if not is_browser_crash(e):
+                print(f"[ERROR] 不是浏览器崩溃，不重启，放弃剩余 {len(remaining)} 个账号")
+                return results, e
+            restarts += 1
+            if restarts > max_browser_restarts():
+                print(f"[ERROR] 浏览器已重启 {restarts - 1} 次，放弃剩余 {len(remaining)} 个账号")
+                return results, e
+            print(f"[WARN] 重启浏览器（第 {restarts} 次），从 {mask_remark(remaining[0][1]['remark'])} 继续，"
+                  f"剩余 {len(remaining)} 个账号")
+
+    return results, None
+
+
+# ============================================================
+#  多进程并行（每个进程独立 Xvfb 显示 + Chrome）
+# ============================================================
+
+def get_worker_count(account_count):
+    try:
+        workers = int(os.environ.get("WEIRDHOST_WORKERS", "1").strip() or 1)
+    except ValueError:
+        print("[WARN] WEIRDHOST_WORKERS 不是有效数字，使用 1")
+        workers = 1
+    return max(1, min(workers, account_count))
+
+
+def start_xvfb(worker_id):
+    try:
+        base = int(os.environ.get("WEIRDHOST_XVFB_BASE", "90"))
+    except ValueError:
+        base = 90
+    display_num = base + worker_id * 10
+    while os.path.exists(f"/tmp/.X{display_num}-lock") or os.path.exists(f"/tmp/.X11-unix/X{display_num}"):
+        display_num += 1
+
+    try:
+        proc = subprocess.Popen(
+            ["Xvfb", f":{display_num}", "-screen", "0", XVFB_SCREEN, "-nolisten", "tcp", "-ac"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+    except FileNotFoundError:
+        print(f"[WARN] [W{worker_id}] 未找到 Xvfb，沿用当前 DISPLAY={os.environ.get('DISPLAY', '')}")
+        return None
+
+    for _ in range(50):
+        if os.path.exists(f"/tmp/.X11-unix/X{display_num}"):
+            break
+        if proc.poll() is not None:
+            print(f"[WARN] [W{worker_id}] Xvfb :{display_num} 启动失败")
+            return None
+        time.sleep(0.1)
+
+    os.environ["DISPLAY"] = f":{display_num}"
+    print(f"[INFO] [W{worker_id}] Xvfb 已启动 DISPLAY=:{display_num}")
+    return proc
+
+
+def account_worker(worker_id, indexed_accounts, renew=True, headless=False):
+    xvfb = None if headless else start_xvfb(worker_id)
+    secrets = {}
+    try:
+        results, error = run_accounts_in_browser(indexed_accounts, notify=False, renew=renew, headless=headless)
+    finally:
+        secrets = flush_github_secrets()
+        shutdown_dispatcher()
+        if xvfb:
+            xvfb.terminate()
+            try:
+                xvfb.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                xvfb.kill()
+    return {"worker": worker_id, "results": results, "error": repr(error) if error else None,
+            "timing": RUN_TIMER.to_dict(), "costs": dict(BUDGET.costs), "secrets": secrets}
+
+
+def run_accounts_in_pool(indexed, workers, renew=True, headless=False):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    chunks = [indexed[w::workers] for w in range(workers)]
+    print(f"[INFO] 并行模式: {workers} 个进程")
+    for w, chunk in enumerate(chunks):
+        print(f"[INFO]   W{w}: {', '.join(mask_remark(a['remark']) for _, a in chunk)}")
+
+    results = []
+    errors = []
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = {pool.submit(account_worker, w, chunk, renew, headless): w for w, chunk in enumerate(chunks)}
+        for fut in as_completed(futures):
+            w = futures[fut]
+            try:
+                out = fut.result()
+            except Exception as e:
+                print(f"[ERROR] W{w} 进程异常: {repr(e)}")
+                errors.append(repr(e))
+                continue
+            apply_cookie_outcomes(out["results"], out.get("secrets") or {})
+            results.extend(out["results"])
+            RUN_TIMER.merge(out.get("timing", {}))
+            BUDGET.merge(out.get("costs"))
+            if out["error"]:
+                print(f"[ERROR] W{w} 浏览器异常: {out['error']}")
+                errors.append(out["error"])
+
+    results.sort(key=lambda r: r.get("account_index", 0))
+    return results, errors
+
+
 # ============================================================
 #  主函数
 # ============================================================
 
-def add_server_time():
-    accounts = detect_accounts()
+def print_summary(results):
+    print(f"\n{'=' * 60}")
+    print("[INFO] 全部处理完成")
+    print(f"{'=' * 60}")
+    icons = {
+        "success": "🟢", "cooldown": "🟡", "skipped": "🔵",
+        "cookie_invalid": "🔒", "no_server": "📭",
+        "error": "❌", "timeout": "⚠️", "checked": "📋", "deferred": "⏸️",
+    }
+    for r in results:
+        icon = icons.get(r["status"], "❓")
+        srv_count = len(r.get("servers", []))
+        email_display = mask_email(r.get("email", ""))
+        remark_display = mask_remark(r.get("remark", "?"))
+        print(f"  {icon} {remark_display} ({email_display}) | "
+              f"{srv_count} 个服务器 | {r['status']} | {r.get('message', '')}")
+
+
+def add_server_time(shard=None, headless=None):
+    if headless is None:
+        headless = headless_enabled()
+    leases = []
+    try:
+        run_renewal(shard, leases, headless)
+    finally:
+        release_leases(leases)
+
+
+def run_renewal(shard, leases, headless=False):
+    accounts = shard_accounts(detect_accounts(), shard)
+
+    if not accounts and shard:
+        print("[INFO] 本分片没有分配到账号")
+        return
 
     if not accounts:
         print("\n" + "=" * 60)
         print("[ERROR] 未检测到任何有效的账号配置")
         print("=" * 60)
-        print("\n请在 GitHub Secrets 中设置 WEIRDHOST_COOKIE_1 ~ WEIRDHOST_COOKIE_5")
+        print("\n请在 GitHub Secrets 中设置 WEIRDHOST_COOKIE_1、WEIRDHOST_COOKIE_2 ...")
+        print("或通过 WEIRDHOST_ACCOUNTS_FILE / WEIRDHOST_ACCOUNTS_DIR 提供账号")
         print("\n格式: 备注-----remember_web_xxx=yyy")
         print("示例: 我的账号-----remember_web_59ba36addc2b2f940CCCC=XXXXXXXXXXX")
         print("\n也支持纯 Cookie 格式 (无备注):")
@@ -1287,62 +4393,201 @@ def add_server_time():
         )
         return
 
+    read_only = os.environ.get("WEIRDHOST_READ_ONLY", "").strip() == "1"
+
     print("=" * 60)
-    print(f"[INFO] Weirdhost 自动续期")
+    print(f"[INFO] Weirdhost 自动续期" + ("（只读状态检查）" if read_only else ""))
     print(f"[INFO] 共 {len(accounts)} 个账号")
     print("=" * 60)
 
+    pending = list(enumerate(accounts))
     results = []
+    state = load_run_state()
+    if not read_only:
+        BUDGET.start()
+        if BUDGET.deadline:
+            print(f"[INFO] 运行时间预算 {BUDGET.remaining() / 60:.0f} 分钟")
+    if not read_only and os.environ.get("WEIRDHOST_FORCE", "").strip() != "1":
+        pending = skip_completed_accounts(pending)
+        if not pending:
+            print("[INFO] 所有账号今日均已处理完成")
+            return
+    if not read_only and planning_enabled():
+        if http_enabled():
+            refresh_state_via_http(state, pending)
+        pending = plan_accounts(state, pending)
+        if not pending:
+            save_run_state(state)
+            print("[INFO] 所有服务器均未到续期时间，无需启动浏览器")
+            return
+        print(f"[INFO] 计划运行 {len(pending)}/{len(accounts)} 个账号")
+    if not read_only:
+        pending = order_by_urgency(state, pending)
+        pending, paths = acquire_leases(pending)
+        leases.extend(paths)
+        if not pending:
+            save_run_state(state)
+            print("[INFO] 所有账号均由其他任务处理中")
+            return
+    if read_only:
+        remaining = []
+        for account_index, account in pending:
+            status = check_account_status_http(account, account_index) if http_enabled() else None
+            if status:
+                results.append(status)
+            else:
+                remaining.append((account_index, account))
+        pending = remaining
+        if pending:
+            print(f"[INFO] {len(pending)} 个账号无可用会话，启动浏览器读取")
+
+    if pending:
+        workers = get_worker_count(len(pending))
+        if workers > 1:
+            browser_results, errors = run_accounts_in_pool(pending, workers, renew=not read_only, headless=headless)
+            error = errors[0] if errors else None
+            if not read_only:
+                for result in browser_results:
+                    send_account_notification(result)
+        else:
+            browser_results, error = run_accounts_in_browser(
+                pending, notify=not read_only, renew=not read_only, headless=headless
+            )
+            error = repr(error) if error else None
+        if error and not browser_results and not results:
+            sync_tg_notify(f"🔔 <b>Weirdhost</b>\n\n❌ 浏览器启动失败\n\n<code>{error}</code>")
+            return
+        results.extend(browser_results)
+        results.sort(key=lambda r: r.get("account_index", 0))
+        apply_cookie_outcomes(results, flush_github_secrets())
+        if not read_only:
+            send_cookie_notification(results)
 
-    try:
-        with SB(
-            uc=True,
-            test=True,
-            locale="ko",
-            headless=False,
-            chromium_arg="--disable-dev-shm-usage,--no-sandbox,--disable-gpu,--disable-software-rasterizer,--disable-background-timer-throttling"
-        ) as sb:
-            print("\n[INFO] 浏览器已启动")
-
-            for i, account in enumerate(accounts):
-                result = process_single_account(sb, account, i)
-                results.append(result)
-
-                send_account_notification(result)
-
-                if i < len(accounts) - 1:
-                    if result.get("status") == "skipped":
-                        wait_time = random.randint(2, 4)
-                    else:
-                        wait_time = random.randint(5, 10)
-                    print(f"\n[INFO] 等待 {wait_time} 秒后处理下一个账号...")
-                    time.sleep(wait_time)
+    for r in results:
+        record_account_results(state, accounts[r.get("account_index", 0)], r)
+    if not read_only:
+        BUDGET.save(state)
+    save_run_state(state)
 
-    except Exception as e:
-        import traceback
-        print(f"\n[ERROR] 浏览器异常: {repr(e)}")
-        traceback.print_exc()
+    if read_only:
+        print_status_table(results)
+    else:
+        print_summary(results)
+        print_deferred(results, state)
 
-        if not results:
-            sync_tg_notify(f"🔔 <b>Weirdhost</b>\n\n❌ 浏览器启动失败\n\n<code>{repr(e)}</code>")
-        return
+    RUN_TIMER.write_report()
+    RUN_TIMER.print_summary()
 
-    print(f"\n{'=' * 60}")
-    print("[INFO] 全部处理完成")
-    print(f"{'=' * 60}")
-    icons = {
-        "success": "🟢", "cooldown": "🟡", "skipped": "🔵",
-        "cookie_invalid": "🔒", "no_server": "📭",
-        "error": "❌", "timeout": "⚠️",
+
+# ============================================================
+#  命令行子命令（status / plan 不启动浏览器）
+# ============================================================
+
+def status_from_state(state, account, account_index):
+    result = {
+        "remark": account["remark"],
+        "cookie_env": account.get("cookie_env", ""),
+        "email": "Unknown",
+        "status": "checked",
+        "servers": [],
+        "account_index": account_index,
     }
-    for r in results:
-        icon = icons.get(r["status"], "❓")
-        srv_count = len(r.get("servers", []))
-        email_display = mask_email(r.get("email", ""))
-        remark_display = mask_remark(r.get("remark", "?"))
-        print(f"  {icon} {remark_display} ({email_display}) | "
-              f"{srv_count} 个服务器 | {r['status']} | {r.get('message', '')}")
+    acc_rec = state["accounts"].get(account_key(account))
+    if not acc_rec:
+        result["status"] = "unknown"
+        result["message"] = "无缓存数据"
+        return result
+    for uuid in acc_rec.get("uuids", []):
+        rec = state["servers"].get(uuid, {})
+        result["servers"].append({
+            "identifier": rec.get("identifier", uuid),
+            "server_type": rec.get("server_type", "?"),
+            "expire": rec.get("expire", "Unknown"),
+        })
+    age_hours = (time.time() - acc_rec.get("updated_at", 0)) / 3600
+    result["email"] = acc_rec.get("email", "Unknown")
+    result["message"] = f"{len(result['servers'])} 个服务器（缓存，{age_hours:.1f} 小时前）"
+    return result
+
+
+def show_status(shard=None, use_http=True):
+    indexed = list(enumerate(shard_accounts(detect_accounts(), shard)))
+    if not indexed:
+        print("[ERROR] 未检测到任何有效的账号配置")
+        return
+    state = load_run_state()
+    results = {}
+    if use_http and http_enabled() and module_available("aiohttp"):
+        with ThreadPoolExecutor(max_workers=min(8, len(indexed))) as pool:
+            statuses = pool.map(lambda item: check_account_status_http(item[1], item[0]), indexed)
+            for (account_index, account), status in zip(indexed, statuses):
+                if status:
+                    results[account_index] = status
+                    record_account_results(state, account, status)
+        if results:
+            save_run_state(state)
+    for account_index, account in indexed:
+        if account_index not in results:
+            results[account_index] = status_from_state(state, account, account_index)
+    print_status_table([results[i] for i, _ in indexed])
+
+
+def show_plan(shard=None):
+    accounts = shard_accounts(detect_accounts(), shard)
+    indexed = list(enumerate(accounts))
+    state = load_run_state()
+    if http_enabled() and module_available("aiohttp"):
+        refresh_state_via_http(state, indexed)
+        save_run_state(state)
+    if not planning_enabled():
+        print("[INFO] 计划已关闭（WEIRDHOST_PLAN=0 或 WEIRDHOST_FORCE=1），renew 会处理全部账号")
+        return
+    due = order_by_urgency(state, plan_accounts(state, indexed))
+    print(f"\n[INFO] renew 将按以下顺序运行 {len(due)}/{len(accounts)} 个账号")
+    for account_index, account in due:
+        print(f"  - [{account_index + 1}] {mask_remark(account['remark'])} "
+              f"（最近到期剩余 {format_remaining_days(account_urgency(state, account))} 天）")
+
+
+COMMANDS = ("renew", "status", "plan")
+
+
+def main(argv=None):
+    import argparse
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ("-h", "--help", "--encrypt-accounts")):
+        argv.insert(0, "renew")
+
+    parser = argparse.ArgumentParser(description="Weirdhost 多账号自动续期")
+    parser.add_argument("--encrypt-accounts", metavar="FILE",
+                        help="用 WEIRDHOST_ACCOUNTS_KEY 加密账号文件，输出 FILE.enc 后退出")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--shard", default=os.environ.get("WEIRDHOST_SHARD", ""),
+                        help="只处理第 i 片账号（共 N 片），格式 i/N")
+    sub = parser.add_subparsers(dest="command")
+    renew = sub.add_parser("renew", parents=[common], help="登录并续期（默认）")
+    renew.add_argument("--headless", action="store_true", default=None,
+                       help="无头模式运行 Chrome，不需要 Xvfb（输入方式自动改为 cdp）")
+    status = sub.add_parser("status", parents=[common], help="显示各服务器到期时间，不启动浏览器")
+    status.add_argument("--cached", action="store_true", help="只读取本地缓存，不发起 HTTP 请求")
+    sub.add_parser("plan", parents=[common], help="显示本次 renew 会处理哪些账号，不启动浏览器")
+    args = parser.parse_args(argv)
+
+    if args.encrypt_accounts:
+        encrypt_accounts_file(args.encrypt_accounts)
+        return
+    shard = parse_shard(args.shard)
+    if args.command == "status":
+        show_status(shard, use_http=not args.cached)
+    elif args.command == "plan":
+        show_plan(shard)
+    else:
+        add_server_time(shard, args.headless)
 
 
 if __name__ == "__main__":
-    add_server_time()
+    try:
+        main()
+    finally:
+        flush_github_secrets()
+        shutdown_dispatcher()